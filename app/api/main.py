@@ -1,15 +1,21 @@
 import os
+import time
 import uuid
-import asyncio
-from fastapi import FastAPI, File, UploadFile, Form
+import threading
+from collections import OrderedDict
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Response, Header
+from fastapi.responses import JSONResponse, StreamingResponse
 from minio import Minio
 
-from app_utils.minio import ensure_bucket_exists, write_file_to_minio
-from app_utils.rabbitmq import (
-    get_rabbit_connection,
-    publish_message,
-    consume_feedback_messages,
+from app_utils.minio import (
+    ensure_bucket_exists,
+    write_file_to_minio,
+    read_file_from_minio,
+    stream_file_from_minio,
 )
+from app_utils.rabbitmq import get_rabbit_connection, publish_message
+from app_utils.ranges import parse_range_header
 
 import logging
 
@@ -27,6 +33,16 @@ RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
 FORWARDING_QUEUE = os.getenv("RABBITMQ_QUEUE_API2INF")
 FEEDBACK_QUEUE = os.getenv("RABBITMQ_QUEUE_INF2API")
+RENDER_QUEUE = os.getenv("RABBITMQ_QUEUE_RENDER")
+SPECTROGRAM_CACHE_SIZE = int(os.getenv("SPECTROGRAM_CACHE_SIZE", "64"))
+RENDER_PENDING_TIMEOUT = float(os.getenv("RENDER_PENDING_TIMEOUT", "60"))
+
+# Model IDs of the routing table of the inference service (`model_id=weights_path,...`)
+MODEL_IDS = {
+    entry.split("=", 1)[0].strip()
+    for entry in os.getenv("MODEL_PATHS", "").split(",")
+    if entry.strip()
+} or {"default"}
 
 logging.info(
     f"Configuration: MINIO_ENDPOINT={MINIO_ENDPOINT}, MINIO_BUCKET={MINIO_BUCKET}"
@@ -47,31 +63,45 @@ ensure_bucket_exists(minio_client, MINIO_BUCKET)
 logging.info("Connecting to RabbitMQ...")
 rabbitmq_connection = get_rabbit_connection(RABBITMQ_HOST, RABBITMQ_PORT)
 rabbitmq_channel = rabbitmq_connection.channel()
+# pika channels are not thread-safe: sync routes run in Starlette's threadpool
+rabbitmq_lock = threading.Lock()
 
 logging.info(f"Declaring queue: {FORWARDING_QUEUE}")
 rabbitmq_channel.queue_declare(queue=FORWARDING_QUEUE)
 
 #################### FEEDBACK QUEUE ####################
+# Consumed by the notifier service, which sends the emails
 logging.info(f"Declaring queue: {FEEDBACK_QUEUE}")
 rabbitmq_channel.queue_declare(queue=FEEDBACK_QUEUE)
 
+#################### RENDER QUEUE ####################
+logging.info(f"Declaring queue: {RENDER_QUEUE}")
+rabbitmq_channel.queue_declare(queue=RENDER_QUEUE)
 
-@app.on_event("startup")
-async def startup_event() -> None:
-    """
-    Startup event handler.
+# Rendered spectrograms never change once written: keep the latest ones in memory
+spectrogram_cache = OrderedDict()
+spectrogram_cache_lock = threading.Lock()
 
-    This function is called when the application starts up. It creates a task to consume feedback messages
-    from the specified RabbitMQ queue using the provided RabbitMQ channel, MinIO client, and MinIO bucket.
+# Formats of the `/results/{ticket_number}` endpoint: object suffix and media type
+RESULT_FORMATS = {
+    "json": ("_results.json", "application/json"),
+    "bin": ("_results.bin", "application/octet-stream"),
+}
 
-    Returns:
-        None
+
+def check_model_id(model_id) -> None:
     """
-    asyncio.create_task(
-        consume_feedback_messages(
-            rabbitmq_channel, FEEDBACK_QUEUE, minio_client, MINIO_BUCKET
+    Rejects the uploads routed to a model that the inference service does not serve,
+    before they reach the queue.
+
+    Raises:
+        HTTPException: 400 if the model ID is not in the routing table.
+    """
+    if model_id is not None and model_id not in MODEL_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown model '{model_id}', expected one of {sorted(MODEL_IDS)}",
         )
-    )
 
 
 #################### ROUTES ####################
@@ -89,7 +119,12 @@ def healthcheck() -> dict:
 
 
 @app.get("/upload-dev")
-async def upload_dev(email: str) -> dict:
+async def upload_dev(
+    email: str,
+    spectrogram: bool = False,
+    profile: bool = False,
+    model_id: Optional[str] = None,
+) -> dict:
     """
     Development upload endpoint.
 
@@ -100,10 +135,18 @@ async def upload_dev(email: str) -> dict:
 
     Args:
         email (str): The email address associated with the upload.
+        spectrogram (bool): Whether to cache the spectrogram for `/spectrogram/{ticket_number}`.
+        profile (bool): Whether to profile the inference of this upload (`x-profile` header).
+        model_id (str, optional): The model to classify with, the default model if not set.
 
     Returns:
         dict: A dictionary containing the filename, success message, email, and ticket number.
+
+    Raises:
+        HTTPException: 400 if the model ID is unknown.
     """
+    check_model_id(model_id)
+
     file_path = "api/Turdus_merlula.wav"
     file_name = file_path.split("/")[-1]
     minio_path = f"{MINIO_BUCKET}/{file_name}"
@@ -128,10 +171,18 @@ async def upload_dev(email: str) -> dict:
             file_content,  # Pass the file content as the data argument
         )
 
-    message = {"minio_path": minio_path, "email": email, "ticket_number": ticket_number}
+    message = {
+        "minio_path": minio_path,
+        "email": email,
+        "ticket_number": ticket_number,
+        "return_spectrogram": spectrogram,
+        "model_id": model_id,
+    }
 
     logging.info("Publishing message to RabbitMQ...")
-    publish_message(rabbitmq_channel, FORWARDING_QUEUE, message)
+    headers = {"x-profile": True} if profile else None
+    with rabbitmq_lock:
+        publish_message(rabbitmq_channel, FORWARDING_QUEUE, message, headers=headers)
 
     return {
         "filename": "Turdus_merlula.wav",
@@ -142,7 +193,12 @@ async def upload_dev(email: str) -> dict:
 
 
 @app.post("/upload")
-async def upload_record(file: UploadFile = File(...), email: str = Form(...)):
+async def upload_record(
+    file: UploadFile = File(...),
+    email: str = Form(...),
+    spectrogram: bool = Form(False),
+    model_id: Optional[str] = Form(None),
+):
     """
     Upload a record endpoint.
 
@@ -155,16 +211,20 @@ async def upload_record(file: UploadFile = File(...), email: str = Form(...)):
     Args:
         file (UploadFile): The audio file to be uploaded. It should be a .wav file.
         email (str): The email address associated with the upload.
+        spectrogram (bool): Whether to cache the spectrogram for `/spectrogram/{ticket_number}`.
+        model_id (str, optional): The model to classify with, the default model if not set.
 
     Returns:
         dict: A dictionary containing the filename, success message, email, and ticket number.
 
     Raises:
         HTTPException: If the uploaded file is not a .wav file, an error message is returned.
+                       400 if the model ID is unknown.
     """
     # Check if the file is a .wav file
     if file.content_type not in ["audio/wav"]:  # TODO: implement .mp3
         return {"error": "Le fichier doit être un fichier audio .wav ou .mp3"}
+    check_model_id(model_id)
 
     file_content = await file.read()
     file_name = file.filename
@@ -181,10 +241,17 @@ async def upload_record(file: UploadFile = File(...), email: str = Form(...)):
 
         write_file_to_minio(minio_client, MINIO_BUCKET, file_name, file_content)
 
-    message = {"minio_path": minio_path, "email": email, "ticket_number": ticket_number}
+    message = {
+        "minio_path": minio_path,
+        "email": email,
+        "ticket_number": ticket_number,
+        "return_spectrogram": spectrogram,
+        "model_id": model_id,
+    }
 
     logging.info("Publishing message to RabbitMQ...")
-    publish_message(rabbitmq_channel, FORWARDING_QUEUE, message)
+    with rabbitmq_lock:
+        publish_message(rabbitmq_channel, FORWARDING_QUEUE, message)
 
     return {
         "filename": file_name,
@@ -192,3 +259,152 @@ async def upload_record(file: UploadFile = File(...), email: str = Form(...)):
         "email": email,
         "ticket_number": ticket_number,
     }
+
+
+@app.get("/spectrogram/{ticket_number}")
+def get_spectrogram(ticket_number: str) -> Response:
+    """
+    Spectrogram image endpoint.
+
+    Serves the PNG spectrogram of a ticket uploaded with `spectrogram=true`.
+    Rendered images are served from an in-memory cache or from MinIO. If the image
+    has not been rendered yet, a render request is published to the render queue
+    and a 202 response is returned: the client should retry later. A
+    `{ticket_number}_spectrogram.pending` marker is written with the request, so that
+    polling clients do not publish it again before `RENDER_PENDING_TIMEOUT` seconds.
+
+    Args:
+        ticket_number (str): The ticket number returned by the upload endpoint.
+
+    Returns:
+        Response: The PNG image, or a 202 JSON response while rendering.
+
+    Raises:
+        HTTPException: 404 if no spectrogram was cached for this ticket.
+    """
+    headers = {"Cache-Control": "public, max-age=86400, immutable"}
+
+    with spectrogram_cache_lock:
+        png_data = spectrogram_cache.get(ticket_number)
+        if png_data is not None:
+            spectrogram_cache.move_to_end(ticket_number)
+    if png_data is not None:
+        return Response(png_data, media_type="image/png", headers=headers)
+
+    png_file_name = f"{ticket_number}_spectrogram.png"
+    try:
+        minio_client.stat_object(MINIO_BUCKET, png_file_name)
+        png_data = read_file_from_minio(minio_client, MINIO_BUCKET, png_file_name)
+    except Exception:
+        png_data = None
+    if png_data is not None:
+        with spectrogram_cache_lock:
+            spectrogram_cache[ticket_number] = png_data
+            if len(spectrogram_cache) > SPECTROGRAM_CACHE_SIZE:
+                spectrogram_cache.popitem(last=False)
+        return Response(png_data, media_type="image/png", headers=headers)
+
+    try:
+        minio_client.stat_object(MINIO_BUCKET, f"{ticket_number}_spectrogram.npy")
+    except Exception:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No spectrogram available for ticket #{ticket_number}",
+        )
+
+    # Publish a single render request per ticket, until it is rendered or timed out
+    pending_file_name = f"{ticket_number}_spectrogram.pending"
+    try:
+        pending = minio_client.stat_object(MINIO_BUCKET, pending_file_name)
+        rendering = time.time() - pending.last_modified.timestamp() < RENDER_PENDING_TIMEOUT
+    except Exception:
+        rendering = False
+
+    if not rendering:
+        logging.info(f"Requesting spectrogram rendering for ticket #{ticket_number}...")
+        write_file_to_minio(minio_client, MINIO_BUCKET, pending_file_name, b"")
+        with rabbitmq_lock:
+            publish_message(
+                rabbitmq_channel, RENDER_QUEUE, {"ticket_number": ticket_number}
+            )
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Spectrogram en cours de génération, réessayez plus tard",
+            "ticket_number": ticket_number,
+        },
+        headers={"Retry-After": "2"},
+    )
+
+
+@app.get("/results/{ticket_number}")
+def get_results(
+    ticket_number: str,
+    format: str = "json",
+    range_header: Optional[str] = Header(None, alias="Range"),
+) -> StreamingResponse:
+    """
+    Classification results endpoint.
+
+    Streams the results of a ticket from MinIO, either as JSON or in the compact
+    binary format (see `app_utils.results`). Single byte ranges are supported,
+    so that large results can be downloaded in parts or resumed.
+
+    Args:
+        ticket_number (str): The ticket number returned by the upload endpoint.
+        format (str): `json` (default) or `bin`.
+        range_header (str, optional): The HTTP Range header.
+
+    Returns:
+        StreamingResponse: The results (206 for a range request).
+
+    Raises:
+        HTTPException: 400 for an unknown format, 404 if the results do not exist,
+                       416 if the range is not satisfiable.
+    """
+    if format not in RESULT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown format '{format}', expected one of {list(RESULT_FORMATS)}",
+        )
+    suffix, media_type = RESULT_FORMATS[format]
+    file_name = f"{ticket_number}{suffix}"
+
+    try:
+        size = minio_client.stat_object(MINIO_BUCKET, file_name).size
+    except Exception:
+        raise HTTPException(
+            status_code=404, detail=f"No results available for ticket #{ticket_number}"
+        )
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{file_name}"',
+    }
+    if range_header is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            stream_file_from_minio(minio_client, MINIO_BUCKET, file_name),
+            media_type=media_type,
+            headers=headers,
+        )
+
+    try:
+        start, end = parse_range_header(range_header, size)
+    except ValueError:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        stream_file_from_minio(
+            minio_client, MINIO_BUCKET, file_name, offset=start, length=end - start + 1
+        ),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
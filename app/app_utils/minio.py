@@ -1,9 +1,16 @@
 import io
 import os
+from datetime import timedelta
+
+import urllib3
 
 import logging
 logging.basicConfig(level=logging.INFO)
 
+# Conditional writes are sent as plain HTTP requests on presigned URLs: the MinIO
+# client does not pass conditional headers to PUT requests
+http_client = urllib3.PoolManager()
+
 
 def ensure_bucket_exists(minio_client, bucket_name) -> None:
     """
@@ -52,6 +59,42 @@ def write_file_to_minio(minio_client, bucket_name, file_name, data) -> None:
         raise
 
 
+def write_file_to_minio_if(minio_client, bucket_name, file_name, data, etag=None):
+    """
+    Writes a file to MinIO only if it does not exist yet (`etag` None) or if it
+    was not modified since it was read with the given ETag. The check and the
+    write are atomic on the server (`If-None-Match: *` and `If-Match` headers).
+
+    Args:
+        minio_client (Minio): MinIO client instance.
+        bucket_name (str): Name of the bucket to write the file to.
+        file_name (str): Name of the file to be written.
+        data (bytes): File data.
+        etag (str, optional): The ETag the existing file must still have.
+
+    Returns:
+        Optional[str]: The ETag of the written file, or None if the condition failed.
+
+    Raises:
+        OSError: If the file could not be written for another reason.
+    """
+    url = minio_client.presigned_put_object(
+        bucket_name, file_name, expires=timedelta(minutes=5)
+    )
+    headers = {"If-None-Match": "*"} if etag is None else {"If-Match": etag}
+    response = http_client.request("PUT", url, body=data, headers=headers)
+    # 409 is returned when a concurrent conditional write on the same file won
+    if response.status in (409, 412):
+        logging.info(f"File '{file_name}' changed in MinIO bucket '{bucket_name}', not written")
+        return None
+    if response.status != 200:
+        raise OSError(
+            f"Error writing file '{file_name}' to MinIO bucket '{bucket_name}': "
+            f"HTTP {response.status} {response.data[:200]!r}"
+        )
+    return response.headers.get("ETag")
+
+
 def fetch_file_from_minio(
     minio_client, bucket_name, file_name, local_file_path
 ) -> bool:
@@ -79,3 +122,58 @@ def fetch_file_from_minio(
             f"Error fetching file '{file_name}' from MinIO bucket '{bucket_name}': {str(e)}"
         )
         return False
+
+
+def read_file_from_minio(minio_client, bucket_name, file_name):
+    """
+    Reads a file from MinIO into memory.
+
+    Args:
+        minio_client (Minio): MinIO client instance.
+        bucket_name (str): Name of the bucket to read the file from.
+        file_name (str): Name of the file to be read.
+
+    Returns:
+        Optional[bytes]: The file content, or None if the file could not be read.
+    """
+    logging.info(f"Reading file '{file_name}' from MinIO bucket '{bucket_name}'...")
+    try:
+        response = minio_client.get_object(bucket_name, file_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception as e:
+        logging.error(
+            f"Error reading file '{file_name}' from MinIO bucket '{bucket_name}': {str(e)}"
+        )
+        return None
+
+
+def stream_file_from_minio(
+    minio_client, bucket_name, file_name, offset=0, length=0, chunk_size=64 * 1024
+):
+    """
+    Streams a file (or a byte range of it) from MinIO without loading it in memory.
+
+    Args:
+        minio_client (Minio): MinIO client instance.
+        bucket_name (str): Name of the bucket to read the file from.
+        file_name (str): Name of the file to be streamed.
+        offset (int, optional): Start of the byte range.
+        length (int, optional): Length of the byte range, up to the end of the file if 0.
+        chunk_size (int, optional): Size of the yielded chunks.
+
+    Yields:
+        bytes: The file content, chunk by chunk.
+    """
+    logging.info(f"Streaming file '{file_name}' from MinIO bucket '{bucket_name}'...")
+    response = minio_client.get_object(
+        bucket_name, file_name, offset=offset, length=length
+    )
+    try:
+        yield from response.stream(chunk_size)
+    finally:
+        response.close()
+        response.release_conn()
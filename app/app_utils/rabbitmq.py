@@ -1,10 +1,8 @@
 import time
 import json
 import pika
-import asyncio
-
-
-from app_utils.smtplib import send_email
+import signal
+from contextlib import contextmanager
 
 import logging
 
@@ -15,6 +13,20 @@ logging.basicConfig(
 # Global variable to manage RabbitMQ connection
 rabbit_connection = None
 
+# Header counting the failed processing attempts of a message
+RETRY_HEADER = "x-retry-count"
+
+
+class MessageTimeoutError(Exception):
+    """Raised when processing a message exceeds its time limit."""
+
+
+class NonRetryableMessageError(Exception):
+    """
+    Raised by a callback when a message can never be processed (malformed body,
+    missing keys, unknown model...): it is dead-lettered without being retried.
+    """
+
 
 def connect_to_rabbitmq(
     host, port, max_retries=5, retry_delay=5
@@ -100,7 +112,7 @@ def publish_minio_path(channel, queue_name, minio_path) -> None:
         logging.error(f"Failed to publish MinIO path: {str(e)}")
 
 
-def publish_message(channel, queue_name, message) -> None:
+def publish_message(channel, queue_name, message, headers=None) -> None:
     """
     Publishes a message to a specified RabbitMQ queue.
 
@@ -108,6 +120,7 @@ def publish_message(channel, queue_name, message) -> None:
         channel: The active channel of the RabbitMQ connection.
         queue_name (str): The name of the queue where the message will be published.
         message (dict): The message to be published, containing the MinIO path, email, and ticket number.
+        headers (dict, optional): AMQP headers to attach to the message.
 
     Returns:
         None
@@ -115,14 +128,17 @@ def publish_message(channel, queue_name, message) -> None:
     logging.info(f"Preparing to publish message to queue: {queue_name}")
     try:
         channel.basic_publish(
-            exchange="", routing_key=queue_name, body=json.dumps(message)
+            exchange="",
+            routing_key=queue_name,
+            body=json.dumps(message),
+            properties=pika.BasicProperties(headers=headers),
         )
         logging.info(f"Published message: {message}")
     except Exception as e:
         logging.error(f"Failed to publish message: {str(e)}")
 
 
-def consume_messages(channel, queue_name, callback) -> None:
+def consume_messages(channel, queue_name, callback, with_properties=False) -> None:
     """
     Consumes messages from a specified RabbitMQ queue and invokes a callback function for each message.
 
@@ -131,6 +147,8 @@ def consume_messages(channel, queue_name, callback) -> None:
         queue_name (str): The name of the queue to consume messages from.
         callback (function): The callback function to be invoked for each received message.
                              The function should accept a single argument, which is the message body.
+        with_properties (bool, optional): If True, the message properties (headers...) are
+                                          passed to the callback as a second argument.
 
     Returns:
         None
@@ -146,63 +164,130 @@ def consume_messages(channel, queue_name, callback) -> None:
             properties: The message properties.
             body: The message body.
         """
-        callback(body)
+        if with_properties:
+            callback(body, properties)
+        else:
+            callback(body)
         ch.basic_ack(delivery_tag=method.delivery_tag)
 
     channel.basic_consume(queue=queue_name, on_message_callback=on_message)
     channel.start_consuming()
 
 
-def process_feedback_message(body, minio_client, minio_bucket) -> None:
+@contextmanager
+def time_limit(seconds):
     """
-    Processes a feedback message received from RabbitMQ.
-
-    This function extracts the email, JSON MinIO path, and ticket number from the message body.
-    It then sends an email using the extracted information and the provided MinIO client and bucket.
-
-    Args:
-        body (bytes): The body of the feedback message received from RabbitMQ.
-        minio_client (Minio): The MinIO client instance used to interact with MinIO.
-        minio_bucket (str): The name of the MinIO bucket where the JSON file is stored.
+    Raises a `MessageTimeoutError` in the enclosed code after `seconds` seconds.
 
-    Returns:
-        None
+    Relies on SIGALRM, so it must be used from the main thread of the process.
+    Does nothing if `seconds` is falsy.
     """
-    data = json.loads(body)
-    email = data["email"]
-    json_minio_path = data["json_minio_path"]
-    ticket_number = data["ticket_number"]
+    if not seconds:
+        yield
+        return
 
-    json_file_path = f"{json_minio_path}"
-    send_email(email, json_file_path, ticket_number, minio_client, minio_bucket)
+    def on_alarm(signum, frame):
+        raise MessageTimeoutError(f"Message processing exceeded {seconds} seconds")
 
-
-async def consume_feedback_messages(
-    rabbitmq_channel, feedback_queue, minio_client, minio_bucket
+    previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def consume_messages_safely(
+    channel,
+    queue_name,
+    callback,
+    dead_letter_queue,
+    max_retries=3,
+    timeout=None,
+    on_failure=None,
+    with_properties=False,
 ) -> None:
     """
-    Consumes feedback messages from the specified RabbitMQ queue.
+    Consumes messages like `consume_messages`, isolating the messages that fail.
 
-    This function continuously consumes feedback messages from the specified RabbitMQ queue.
-    For each received message, it processes the message using the `process_feedback_message` function
-    and acknowledges the message. If no message is available, it waits for 1 second before checking again.
+    A message whose callback raises or exceeds `timeout` is republished at the end of
+    the queue with its `x-retry-count` header incremented, so that the next messages
+    are not blocked. Once it failed more than `max_retries` times, it is moved to the
+    dead-letter queue and `on_failure` is called. A message whose callback raises a
+    `NonRetryableMessageError` is dead-lettered right away. A redelivered message (the
+    worker died before acknowledging it) counts as a failed attempt.
 
     Args:
-        rabbitmq_channel (pika.adapters.blocking_connection.BlockingChannel): The RabbitMQ channel used for consuming messages.
-        feedback_queue (str): The name of the RabbitMQ queue to consume feedback messages from.
-        minio_client (Minio): The MinIO client instance used to interact with MinIO.
-        minio_bucket (str): The name of the MinIO bucket where the JSON files are stored.
+        channel: The active channel of the RabbitMQ connection.
+        queue_name (str): The name of the queue to consume messages from.
+        callback (function): The callback function to be invoked for each received message.
+        dead_letter_queue (str): The name of the queue receiving the messages that keep failing.
+        max_retries (int, optional): The number of retries before dead-lettering a message.
+        timeout (float, optional): The time limit in seconds of a callback, no limit if None.
+        on_failure (function, optional): Called with the message body and the last error
+                                         when a message is dead-lettered.
+        with_properties (bool, optional): If True, the message properties are passed to
+                                          the callback as a second argument.
 
     Returns:
         None
     """
-    while True:
-        method_frame, _, body = rabbitmq_channel.basic_get(queue=feedback_queue)
-        if method_frame:
-            process_feedback_message(body, minio_client, minio_bucket)
-            rabbitmq_channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+    logging.info(f"Declaring dead-letter queue: {dead_letter_queue}")
+    channel.queue_declare(queue=dead_letter_queue)
+
+    def handle_failure(ch, properties, body, error, retryable=True):
+        headers = dict(properties.headers or {})
+        retry_count = headers.get(RETRY_HEADER, 0) + 1
+        headers[RETRY_HEADER] = retry_count
+        headers["x-last-error"] = str(error)[:512]
+        retry_properties = pika.BasicProperties(headers=headers)
+
+        if retryable and retry_count <= max_retries:
+            logging.warning(
+                f"Message failed ({error}), retrying ({retry_count}/{max_retries})"
+            )
+            ch.basic_publish(
+                exchange="", routing_key=queue_name, body=body, properties=retry_properties
+            )
+            return
+
+        logging.error(
+            f"Message failed {retry_count} times ({error}), moving it to {dead_letter_queue}"
+        )
+        ch.basic_publish(
+            exchange="",
+            routing_key=dead_letter_queue,
+            body=body,
+            properties=retry_properties,
+        )
+        if on_failure is not None:
+            try:
+                on_failure(body, error)
+            except Exception as e:
+                logging.error(f"Failed to notify message failure: {str(e)}")
+
+    def on_message(ch, method, properties, body):
+        if method.redelivered:
+            error = "Worker stopped while processing the message"
+            handle_failure(ch, properties, body, error)
         else:
-            await asyncio.sleep(1)  # Wait for 1 second before checking again
+            try:
+                with time_limit(timeout):
+                    if with_properties:
+                        callback(body, properties)
+                    else:
+                        callback(body)
+            except NonRetryableMessageError as e:
+                logging.error(f"Message cannot be processed: {str(e)}")
+                handle_failure(ch, properties, body, e, retryable=False)
+            except Exception as e:
+                logging.exception(f"Error while processing message: {str(e)}")
+                handle_failure(ch, properties, body, e)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    channel.basic_consume(queue=queue_name, on_message_callback=on_message)
+    channel.start_consuming()
 
 
 #########################################################
@@ -288,20 +373,3 @@ class RabbitMQClient:
 
         self.channel.basic_consume(queue=queue_name, on_message_callback=on_message)
         self.channel.start_consuming()
-
-    def process_feedback_message(self, message):
-        data = json.loads(message.decode("utf-8"))
-        email = data["email"]
-        ticket_number = data["ticket_number"]
-        json_data = json.dumps(data, indent=4)  # Format the JSON data for readability
-
-        send_email(email, json_data, ticket_number)
-
-    async def consume_feedback_messages(self, feedback_queue):
-        while True:
-            method_frame, _, body = self.channel.basic_get(queue=feedback_queue)
-            if method_frame:
-                self.process_feedback_message(body)
-                self.channel.basic_ack(delivery_tag=method_frame.delivery_tag)
-            else:
-                await asyncio.sleep(1)  # Wait for 1 second before checking again
@@ -0,0 +1,31 @@
+def parse_range_header(range_header, size) -> tuple:
+    """
+    Parses a single `bytes=start-end` HTTP range.
+
+    Supports `bytes=start-end`, open-ended `bytes=start-` and suffix `bytes=-length`
+    ranges. The end offset is clamped to the last byte of the object.
+
+    Args:
+        range_header (str): The value of the Range header.
+        size (int): The size of the requested object.
+
+    Returns:
+        tuple: The (start, end) offsets of the range, both inclusive.
+
+    Raises:
+        ValueError: If the range is malformed or not satisfiable (a 416 response).
+    """
+    unit, _, byte_range = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in byte_range:
+        raise ValueError(f"Unsupported range: {range_header!r}")
+
+    start, _, end = byte_range.strip().partition("-")
+    if start:
+        start, end = int(start), int(end) if end else size - 1
+    else:
+        # Suffix range: the last `end` bytes
+        start, end = max(size - int(end), 0), size - 1
+
+    if start < 0 or start > end or start >= size:
+        raise ValueError(f"Range not satisfiable: {range_header!r} ({size} bytes)")
+    return start, min(end, size - 1)
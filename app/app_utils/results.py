@@ -0,0 +1,92 @@
+import sys
+import struct
+from array import array
+
+# Binary results layout (little-endian):
+#   header:  magic "BSCR" | version (uint8) | number of species (uint16)
+#   species: name length (uint16) | name (utf-8) | number of detections N (uint32)
+#            | time_start[N] | freq_start[N] | time_end[N] | freq_end[N] | score[N]
+#              (float32 columns, bounding boxes in spectrogram pixel coordinates)
+RESULTS_MAGIC = b"BSCR"
+RESULTS_VERSION = 1
+HEADER = struct.Struct("<4sBH")
+NAME_LENGTH = struct.Struct("<H")
+DETECTION_COUNT = struct.Struct("<I")
+
+
+def _float32_column(values) -> bytes:
+    column = array("f", values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def encode_results(output) -> bytes:
+    """
+    Encodes a classification output into the compact binary results format.
+
+    Args:
+        output (dict): The classification output, mapping bird names to
+                       their `bbox_coord` and `scores` lists.
+
+    Returns:
+        bytes: The encoded results.
+    """
+    parts = [HEADER.pack(RESULTS_MAGIC, RESULTS_VERSION, len(output))]
+    for bird_name, detection in output.items():
+        name = bird_name.encode("utf-8")
+        boxes = detection["bbox_coord"]
+        parts.append(NAME_LENGTH.pack(len(name)))
+        parts.append(name)
+        parts.append(DETECTION_COUNT.pack(len(boxes)))
+        for coordinate in range(4):
+            parts.append(_float32_column(box[coordinate] for box in boxes))
+        parts.append(_float32_column(detection["scores"]))
+    return b"".join(parts)
+
+
+def decode_results(data) -> dict:
+    """
+    Decodes binary results back into the classification output structure.
+
+    Coordinates and scores are float32 values, so they may differ from the original
+    output beyond the 7th significant digit.
+
+    Args:
+        data (bytes): The encoded results.
+
+    Returns:
+        dict: The classification output, mapping bird names to
+              their `bbox_coord` and `scores` lists.
+
+    Raises:
+        ValueError: If the data is not in the binary results format.
+    """
+    magic, version, n_species = HEADER.unpack_from(data, 0)
+    if magic != RESULTS_MAGIC or version != RESULTS_VERSION:
+        raise ValueError("Unsupported binary results format")
+
+    output = {}
+    offset = HEADER.size
+    for _ in range(n_species):
+        (name_length,) = NAME_LENGTH.unpack_from(data, offset)
+        offset += NAME_LENGTH.size
+        bird_name = data[offset : offset + name_length].decode("utf-8")
+        offset += name_length
+        (count,) = DETECTION_COUNT.unpack_from(data, offset)
+        offset += DETECTION_COUNT.size
+
+        columns = []
+        for _ in range(5):
+            column = array("f")
+            column.frombytes(data[offset : offset + 4 * count])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns.append(column.tolist())
+            offset += 4 * count
+
+        output[bird_name] = {
+            "bbox_coord": [list(box) for box in zip(*columns[:4])],
+            "scores": columns[4],
+        }
+    return output
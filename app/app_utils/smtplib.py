@@ -1,90 +1,104 @@
+import os
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
-from tempfile import NamedTemporaryFile
-from app_utils.minio import fetch_file_from_minio
 
 import logging
 logging.basicConfig(level=logging.INFO)
 
+# SMTP configuration for MailHog
+SMTP_SERVER = "mailhog"
+SMTP_PORT = 1025
+SENDER_EMAIL = "sender@example.com"
+
+# Results larger than this are only linked in the email, not attached
+API_PUBLIC_URL = os.getenv("API_PUBLIC_URL", "http://localhost:8001")
+MAX_ATTACHMENT_BYTES = int(os.getenv("MAX_ATTACHMENT_BYTES", str(1024 * 1024)))
 
-def send_email(
-    email, json_minio_path, ticket_number, minio_client, minio_bucket
-) -> None:
-    """
-    Sends an email with the classification results as an attachment.
 
-    The function fetches the JSON file containing the classification results from MinIO,
-    creates an email message with the JSON file as an attachment, and sends the email
-    using the specified SMTP server (MailHog).
+def build_results_email(email, ticket_number, json_data=None) -> MIMEMultipart:
+    """
+    Builds the email announcing the classification results of a ticket.
 
     Args:
         email (str): The recipient's email address.
-        json_minio_path (str): The path to the JSON file in MinIO.
         ticket_number (str): The ticket number associated with the classification request.
-        minio_client (Minio): The MinIO client instance.
-        minio_bucket (str): The name of the MinIO bucket where the JSON file is stored.
+        json_data (bytes, optional): The JSON results to attach, only linked if None.
 
     Returns:
-        None
-
-    Raises:
-        Exception: If an error occurs while sending the email.
-
-    Note:
-        The function uses MailHog as the SMTP server for sending emails. Make sure MailHog
-        is running and accessible at the specified SMTP server and port.
-
-        The function creates a temporary file to store the fetched JSON file locally before
-        attaching it to the email. The temporary file is automatically deleted when the
-        function exits.
+        MIMEMultipart: The email message.
     """
-    # SMTP configuration for MailHog
-    smtp_server = "mailhog"
-    smtp_port = 1025
-    sender_email = "sender@example.com"
-
-    # Create a temporary file to store the fetched JSON file
-    with NamedTemporaryFile(delete=False) as temp_file:
-        local_file_path = temp_file.name
-
-        # Fetch the JSON file from MinIO and save it locally
-        success = fetch_file_from_minio(
-            minio_client, minio_bucket, json_minio_path, local_file_path
-        )
-
-        if not success:
-            logging.error(
-                f"Failed to fetch JSON file '{json_minio_path}' from MinIO. Skipping email sending."
-            )
-            return
-
-        # Read the JSON file contents
-        with open(local_file_path, "rb") as file:
-            json_data = file.read()
+    results_url = f"{API_PUBLIC_URL}/results/{ticket_number}"
 
     # Create the email message
     message = MIMEMultipart()
-    message["From"] = sender_email
+    message["From"] = SENDER_EMAIL
     message["To"] = email
     message["Subject"] = f"Classification Results - Ticket #{ticket_number}"
 
     # Attach the email body
-    body = f"Please find the classification results attached.\n\nTicket Number: {ticket_number}"
+    if json_data is not None:
+        body = f"Please find the classification results attached.\n\nTicket Number: {ticket_number}"
+    else:
+        body = f"Your classification results are ready.\n\nTicket Number: {ticket_number}"
+    body += f"\n\nDownload the results: {results_url}"
     message.attach(MIMEText(body, "plain"))
 
     # Attach the JSON file
-    json_file = MIMEApplication(json_data, _subtype="json")
-    json_file.add_header(
-        "Content-Disposition", "attachment", filename="classification_results.json"
+    if json_data is not None:
+        json_file = MIMEApplication(json_data, _subtype="json")
+        json_file.add_header(
+            "Content-Disposition", "attachment", filename="classification_results.json"
+        )
+        message.attach(json_file)
+    return message
+
+
+def build_failure_email(email, ticket_number, error) -> MIMEText:
+    """
+    Builds the email notifying the user that the classification of their file failed.
+
+    Args:
+        email (str): The recipient's email address.
+        ticket_number (str): The ticket number associated with the classification request.
+        error (str): The last error raised while processing the request.
+
+    Returns:
+        MIMEText: The email message.
+    """
+    message = MIMEText(
+        f"The classification of your file could not be completed.\n\n"
+        f"Ticket Number: {ticket_number}\nError: {error}",
+        "plain",
     )
-    message.attach(json_file)
+    message["From"] = SENDER_EMAIL
+    message["To"] = email
+    message["Subject"] = f"Classification Failed - Ticket #{ticket_number}"
+    return message
 
-    # Send the email
+
+def send_messages(messages) -> list:
+    """
+    Sends a batch of email messages over a single SMTP connection.
+
+    Args:
+        messages (list): The email messages to send.
+
+    Returns:
+        list: One boolean per message, True if it was sent successfully.
+    """
+    sent = [False] * len(messages)
     try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.send_message(message)
-        logging.info(f"\n\nEmail sent successfully to {email} for ticket #{ticket_number}\n\n")
+        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+            for idx, message in enumerate(messages):
+                try:
+                    server.send_message(message)
+                    sent[idx] = True
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except Exception as e:
+                    logging.error(f"Failed to send email to {message['To']}. Error: {str(e)}")
     except Exception as e:
-        logging.error(f"\n\nFailed to send email to {email} for ticket #{ticket_number}. Error: {str(e)}\n\n")
\ No newline at end of file
+        logging.error(f"SMTP connection to {SMTP_SERVER}:{SMTP_PORT} failed. Error: {str(e)}")
+    return sent
@@ -1,11 +1,25 @@
 import os
+import gc
 import json
+import time
+import multiprocessing
+from contextlib import nullcontext
+import torch
 from minio import Minio
 
 from src.models.bird_dict import BIRD_DICT
-from app_utils.rabbitmq import get_rabbit_connection, consume_messages, publish_message
+from app_utils.rabbitmq import (
+    get_rabbit_connection,
+    consume_messages_safely,
+    publish_message,
+    NonRetryableMessageError,
+)
 from app_utils.minio import write_file_to_minio
-from model_serve.model_serve import ModelServer
+from app_utils.results import encode_results
+from model_serve.registry import DEFAULT_MODEL_ID, ModelRegistry, parse_model_paths
+from model_serve.prefilter import ActivityPrefilter
+from model_serve.render import encode_spectrogram
+from model_serve.profiling import profile_pipeline
 
 
 import logging
@@ -19,19 +33,47 @@ logger = logging.getLogger(__name__)
 
 
 #################### CONFIG ####################
-WEIGHTS_PATH = "models/detr_noneg_100q_bs20_r50dc5"
 TEST_FILE_PATH = "inference/Turdus_merlula.wav"
 
+# Model routing table: `model_id=weights_path,...` (default model only if empty)
+MODEL_PATHS = parse_model_paths(os.getenv("MODEL_PATHS"))
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", DEFAULT_MODEL_ID).split(",")
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "2048"))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+# Intra-op threads per worker, so that the workers do not oversubscribe the cores
+INFERENCE_THREADS = int(
+    os.getenv("INFERENCE_THREADS", "0")
+) or max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS)
+
+# Activity prefilter: files without any window of candidate bird activity skip the model
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "1") == "1"
+PREFILTER_WINDOW_SECONDS = float(os.getenv("PREFILTER_WINDOW_SECONDS", "1.0"))
+PREFILTER_ENERGY_DB = float(os.getenv("PREFILTER_ENERGY_DB", "-70"))
+PREFILTER_PEAK_RATIO_DB = float(os.getenv("PREFILTER_PEAK_RATIO_DB", "14"))
+PREFILTER_PADDING_SECONDS = float(os.getenv("PREFILTER_PADDING_SECONDS", "1.0"))
+PREFILTER_MAX_ACTIVE_FRACTION = float(os.getenv("PREFILTER_MAX_ACTIVE_FRACTION", "0.8"))
+PREFILTER_COLUMNS_PER_SECOND = float(os.getenv("PREFILTER_COLUMNS_PER_SECOND", "0"))
+
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
 FORWARDING_QUEUE = os.getenv("RABBITMQ_QUEUE_API2INF")
 FEEDBACK_QUEUE = os.getenv("RABBITMQ_QUEUE_INF2API")
+DEAD_LETTER_QUEUE = os.getenv("RABBITMQ_QUEUE_DLQ")
+MAX_RETRIES = int(os.getenv("INFERENCE_MAX_RETRIES", "3"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "300"))
 
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
 MINIO_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 MINIO_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 MINIO_BUCKET = os.getenv("MINIO_BUCKET")
 
+# Profiling: messages with the `x-profile` header are always profiled,
+# and every Nth message is profiled if PROFILE_EVERY_N > 0
+PROFILE_HEADER = "x-profile"
+PROFILE_EVERY_N = int(os.getenv("PROFILE_EVERY_N", "0"))
+PROFILE_DIR = "/tmp/profiles"
+messages_received = 0
+
 #################### STORAGE ####################
 minio_client = Minio(
     MINIO_ENDPOINT,
@@ -40,22 +82,138 @@ minio_client = Minio(
     secure=False,
 )
 
+#################### MODELS ####################
+prefilter = (
+    ActivityPrefilter(
+        window_seconds=PREFILTER_WINDOW_SECONDS,
+        energy_threshold_db=PREFILTER_ENERGY_DB,
+        peak_ratio_db=PREFILTER_PEAK_RATIO_DB,
+        padding_seconds=PREFILTER_PADDING_SECONDS,
+        max_active_fraction=PREFILTER_MAX_ACTIVE_FRACTION,
+        columns_per_second=PREFILTER_COLUMNS_PER_SECOND,
+    )
+    if PREFILTER_ENABLED
+    else None
+)
+registry = ModelRegistry(MODEL_PATHS, BIRD_DICT, MODEL_MEMORY_BUDGET_MB, prefilter)
+
 
 #################### QUEUE ####################
-def callback(body) -> None:
-    message = json.loads(body.decode())
-    minio_path = message["minio_path"]
-    email = message["email"]
-    ticket_number = message["ticket_number"]
+def should_profile(properties) -> bool:
+    global messages_received
+    messages_received += 1
+
+    headers = properties.headers or {}
+    if headers.get(PROFILE_HEADER):
+        return True
+    return PROFILE_EVERY_N > 0 and messages_received % PROFILE_EVERY_N == 0
+
+
+def callback(body, properties) -> None:
+    # Malformed messages and unknown models would fail the same way on every retry
+    try:
+        message = json.loads(body.decode())
+        minio_path = message["minio_path"]
+        email = message["email"]
+        ticket_number = message["ticket_number"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise NonRetryableMessageError(f"Malformed message: {e!r}")
+    return_spectrogram = message.get("return_spectrogram", False)
+    model_id = message.get("model_id") or DEFAULT_MODEL_ID
+    if model_id not in registry.model_paths:
+        raise NonRetryableMessageError(f"Unknown model ID: {model_id}")
 
     logger.info(
-        f"Received message from RabbitMQ: MinIO path={minio_path}, Email={email}, Ticket number={ticket_number}"
+        f"Received message from RabbitMQ: MinIO path={minio_path}, Email={email}, Ticket number={ticket_number}, Model={model_id}"
+    )
+    run_inference_pipeline(
+        minio_path,
+        email,
+        ticket_number,
+        return_spectrogram,
+        profile=should_profile(properties),
+        model_id=model_id,
     )
-    run_inference_pipeline(minio_path, email, ticket_number)
+
+
+def notify_failure(body, error) -> None:
+    """
+    Notifies the user through the feedback queue that a message was dead-lettered.
+    """
+    message = json.loads(body.decode())
+    feedback = {
+        "email": message["email"],
+        "ticket_number": message["ticket_number"],
+        "status": "failed",
+        "error": str(error),
+    }
+    publish_message(rabbitmq_channel, FEEDBACK_QUEUE, feedback)
 
 
 #################### ML I/O  ####################
-def run_inference_pipeline(minio_path, email, ticket_number) -> None:
+def cache_spectrogram(ticket_number, spectrogram) -> None:
+    """
+    Stores the spectrogram of a ticket in MinIO, so that the render workers
+    can draw the spectrogram image on demand.
+    """
+    write_file_to_minio(
+        minio_client,
+        MINIO_BUCKET,
+        f"{ticket_number}_spectrogram.npy",
+        encode_spectrogram(spectrogram),
+    )
+
+
+def write_results(ticket_number, output) -> None:
+    """
+    Stores the full detections of a ticket in MinIO, as compact JSON and in the
+    binary results format, for the `/results/{ticket_number}` endpoint.
+    """
+    write_file_to_minio(
+        minio_client,
+        MINIO_BUCKET,
+        f"{ticket_number}_results.json",
+        json.dumps(output, separators=(",", ":")).encode("utf-8"),
+    )
+    write_file_to_minio(
+        minio_client,
+        MINIO_BUCKET,
+        f"{ticket_number}_results.bin",
+        encode_results(output),
+    )
+
+
+def upload_profile(ticket_number, report) -> None:
+    """
+    Uploads the profiling files of a ticket to MinIO, then deletes the local files.
+
+    Profiling is best effort: upload errors are logged and never fail the request.
+    """
+    for path in (report["trace_path"], report["stacks_path"]):
+        try:
+            with open(path, "rb") as file:
+                write_file_to_minio(
+                    minio_client,
+                    MINIO_BUCKET,
+                    f"profiles/{os.path.basename(path)}",
+                    file,
+                )
+        except Exception as e:
+            logger.error(f"Failed to upload profile '{path}' to MinIO: {str(e)}")
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+    logger.info(f"Profiling summary for ticket #{ticket_number}:\n{report['summary']}")
+
+
+def run_inference_pipeline(
+    minio_path,
+    email,
+    ticket_number,
+    return_spectrogram=False,
+    profile=False,
+    model_id=DEFAULT_MODEL_ID,
+) -> None:
     file_name = os.path.basename(minio_path)
     local_file_path = f"/tmp/{file_name}"  # Temporary local file path
 
@@ -65,17 +223,34 @@ def run_inference_pipeline(minio_path, email, ticket_number) -> None:
         logger.info(f"WAV file downloaded from MinIO: {file_name}")
     except Exception as e:
         logger.error(f"Error downloading WAV file from MinIO: {str(e)}")
-        return
+        raise
+
+    inference = registry.get(model_id)
+
+    profiler = (
+        profile_pipeline(PROFILE_DIR, ticket_number) if profile else nullcontext()
+    )
+    start = time.perf_counter()
+    with profiler as report:
+        result = inference.get_classification(local_file_path, return_spectrogram)
+    registry.record_latency(
+        model_id, time.perf_counter() - start, inference.prefilter_report
+    )
+    if profile:
+        upload_profile(ticket_number, report)
 
-    inference = ModelServer(WEIGHTS_PATH, BIRD_DICT)
-    inference.load()
-    output = inference.get_classification(local_file_path)
+    if return_spectrogram:
+        output, spectrogram = result
+        cache_spectrogram(ticket_number, spectrogram)
+    else:
+        output = result
     logger.info(f"Classification output: {output}")
+    write_results(ticket_number, output)
 
     json_file_name = os.path.splitext(file_name)[0] + ".json"
-    json_output = list(output.values())[
-        0
-    ]  # Extract the JSON output from the dictionary
+    json_output = (
+        list(output.values())[0] if output else {}
+    )  # Extract the JSON output from the dictionary
 
     # Write the JSON output to MinIO using the helper function
     json_data = json.dumps(json_output).encode("utf-8")
@@ -85,14 +260,21 @@ def run_inference_pipeline(minio_path, email, ticket_number) -> None:
     message = {
         "wav_minio_path": f"{MINIO_BUCKET}/{file_name}",
         "json_minio_path": f"{json_file_name}",
+        "results_minio_path": f"{ticket_number}_results.json",
         "email": email,
         "ticket_number": ticket_number,
+        "status": "done",
     }
     publish_message(rabbitmq_channel, FEEDBACK_QUEUE, message)
 
 
 #################### MAIN LOOP ####################
-if __name__ == "__main__":
+def consume() -> None:
+    global rabbitmq_channel
+
+    torch.set_num_threads(INFERENCE_THREADS)
+    logger.info(f"[pid {os.getpid()}] Using {INFERENCE_THREADS} intra-op threads")
+
     rabbitmq_connection = get_rabbit_connection(RABBITMQ_HOST, RABBITMQ_PORT)
     rabbitmq_channel = rabbitmq_connection.channel()
     rabbitmq_channel.queue_declare(queue=FORWARDING_QUEUE)
@@ -100,5 +282,35 @@ if __name__ == "__main__":
     logging.info(f"Declaring queue: {FEEDBACK_QUEUE}")
     rabbitmq_channel.queue_declare(queue=FEEDBACK_QUEUE)
 
+    # One message at a time per worker, so that idle workers get the next ones
+    rabbitmq_channel.basic_qos(prefetch_count=1)
+
     logger.info(f"Waiting for messages from queue: {FORWARDING_QUEUE}")
-    consume_messages(rabbitmq_channel, FORWARDING_QUEUE, callback)
+    consume_messages_safely(
+        rabbitmq_channel,
+        FORWARDING_QUEUE,
+        callback,
+        DEAD_LETTER_QUEUE,
+        max_retries=MAX_RETRIES,
+        timeout=INFERENCE_TIMEOUT,
+        on_failure=notify_failure,
+        with_properties=True,
+    )
+
+
+if __name__ == "__main__":
+    # Models are loaded before forking so that workers share their weights
+    # copy-on-write; freezing the GC keeps it from touching the shared pages
+    registry.preload(PRELOAD_MODELS)
+    gc.freeze()
+
+    if INFERENCE_WORKERS > 1:
+        logger.info(f"Forking {INFERENCE_WORKERS} inference workers...")
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=consume) for _ in range(INFERENCE_WORKERS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        consume()
@@ -0,0 +1,48 @@
+"""
+Profiles the inference pipeline on a local WAV file, without RabbitMQ nor MinIO.
+
+Usage (from /app in the inference container):
+    python3 inference/profile_local.py inference/Turdus_merlula.wav --output-dir profiles
+"""
+import os
+import argparse
+
+from src.models.bird_dict import BIRD_DICT
+from model_serve.model_serve import ModelServer, WEIGHTS_PATH
+from model_serve.profiling import profile_pipeline
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("wav_path", help="Path of the WAV file to classify")
+    parser.add_argument("--weights", default=WEIGHTS_PATH, help="Model weights path")
+    parser.add_argument(
+        "--output-dir", default="profiles", help="Directory of the profiling files"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Unprofiled runs before profiling"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.005,
+        help="Python stack sampling interval in seconds",
+    )
+    args = parser.parse_args()
+
+    inference = ModelServer(args.weights, BIRD_DICT)
+    inference.load()
+    for _ in range(args.warmup):
+        inference.get_classification(args.wav_path)
+
+    name = os.path.splitext(os.path.basename(args.wav_path))[0]
+    with profile_pipeline(args.output_dir, name, args.interval) as report:
+        inference.get_classification(args.wav_path)
+
+    print(report["summary"])
+    print(f"Chrome trace: {report['trace_path']}")
+    print(f"Folded stacks (flamegraph): {report['stacks_path']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import json
+import functools
+from minio import Minio
+
+from app_utils.rabbitmq import get_rabbit_connection
+from app_utils.minio import read_file_from_minio, write_file_to_minio
+from model_serve.render import RenderPool
+
+
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+
+#################### CONFIG ####################
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
+RENDER_QUEUE = os.getenv("RABBITMQ_QUEUE_RENDER")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
+MINIO_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
+MINIO_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+MINIO_BUCKET = os.getenv("MINIO_BUCKET")
+
+#################### STORAGE ####################
+minio_client = Minio(
+    MINIO_ENDPOINT,
+    access_key=MINIO_ACCESS_KEY,
+    secret_key=MINIO_SECRET_KEY,
+    secure=False,
+)
+
+
+#################### QUEUE ####################
+def on_message(ch, method, properties, body) -> None:
+    """
+    Handles a render request: fetches the cached spectrogram and detections of the
+    ticket, renders them in the pool and uploads the PNG image to MinIO.
+
+    The message is acknowledged once the image is uploaded (or rendering or the upload
+    failed), from the connection thread as required by pika. The `.pending` marker
+    written by the API is removed once the image is uploaded.
+    """
+    message = json.loads(body.decode())
+    ticket_number = message["ticket_number"]
+    png_file_name = f"{ticket_number}_spectrogram.png"
+    ack = functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag)
+
+    logger.info(f"Received render request for ticket #{ticket_number}")
+
+    try:
+        minio_client.stat_object(MINIO_BUCKET, png_file_name)
+        logger.info(f"Spectrogram for ticket #{ticket_number} already rendered.")
+        ack()
+        return
+    except Exception:
+        pass
+
+    spectrogram_data = read_file_from_minio(
+        minio_client, MINIO_BUCKET, f"{ticket_number}_spectrogram.npy"
+    )
+    detections_data = read_file_from_minio(
+        minio_client, MINIO_BUCKET, f"{ticket_number}_results.json"
+    )
+    if spectrogram_data is None or detections_data is None:
+        logger.error(f"No cached spectrogram for ticket #{ticket_number}. Skipping.")
+        ack()
+        return
+
+    def on_rendered(png_data):
+        try:
+            write_file_to_minio(minio_client, MINIO_BUCKET, png_file_name, png_data)
+            minio_client.remove_object(
+                MINIO_BUCKET, f"{ticket_number}_spectrogram.pending"
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to upload spectrogram for ticket #{ticket_number}: {str(e)}"
+            )
+        finally:
+            rabbitmq_connection.add_callback_threadsafe(ack)
+
+    def on_error(e):
+        logger.error(f"Failed to render spectrogram for ticket #{ticket_number}: {e}")
+        rabbitmq_connection.add_callback_threadsafe(ack)
+
+    render_pool.submit(
+        spectrogram_data, json.loads(detections_data), on_rendered, on_error
+    )
+
+
+#################### MAIN LOOP ####################
+if __name__ == "__main__":
+    render_pool = RenderPool(RENDER_WORKERS)
+
+    rabbitmq_connection = get_rabbit_connection(RABBITMQ_HOST, RABBITMQ_PORT)
+    rabbitmq_channel = rabbitmq_connection.channel()
+
+    logging.info(f"Declaring queue: {RENDER_QUEUE}")
+    rabbitmq_channel.queue_declare(queue=RENDER_QUEUE)
+    rabbitmq_channel.basic_qos(prefetch_count=RENDER_WORKERS)
+
+    logger.info(f"Waiting for render requests from queue: {RENDER_QUEUE}")
+    rabbitmq_channel.basic_consume(queue=RENDER_QUEUE, on_message_callback=on_message)
+    try:
+        rabbitmq_channel.start_consuming()
+    finally:
+        render_pool.close()
@@ -1,8 +1,12 @@
 import os
 import json
 import glob
+import tempfile
+import numpy as np
+from torch.profiler import record_function
 from src.models.run_detection_cpu import load_model, run_detection
-from src.visualization.visu import merge_images, visualise_model_out
+from src.visualization.visu import merge_images
+from model_serve.render import spectrogram_to_array
 
 import logging
 
@@ -18,8 +22,10 @@ TEST_FILE_PATH = "inference/Turdus_merlula.wav"
 
 
 class ModelServer:
-    def __init__(self, weights_path, bird_dict) -> None:
+    def __init__(self, weights_path, bird_dict, prefilter=None) -> None:
         self.weights_path = weights_path
+        self.prefilter = prefilter
+        self.prefilter_report = None
         logger.info("Weights path: {self.weights_path}")
 
         self.bird_dict = bird_dict
@@ -39,6 +45,15 @@ class ModelServer:
         logger.info("Model loaded successfully")
         self.model_loaded = True
 
+    def memory_footprint(self) -> int:
+        """
+        Returns the size in bytes of the model parameters and buffers (0 if not loaded).
+        """
+        if not self.model_loaded:
+            return 0
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
     def run_detection(self, file_path, return_spectrogram=False):
         spectrogram = None
 
@@ -46,19 +61,22 @@ class ModelServer:
             self.load()
 
         logger.info(f"Starting run_detection on {file_path.split('/')[-1]}...")
-        fp, outputs, spectrogram = run_detection(
-            self.model, self.config, file_path, return_spectrogram=return_spectrogram
-        )
+        with record_function("run_detection"):
+            fp, outputs, spectrogram = run_detection(
+                self.model, self.config, file_path, return_spectrogram=return_spectrogram
+            )
         logger.info(f"[fp]: \n{fp}\n\n")
         self.detection_ready = True
 
         return fp, outputs, spectrogram
 
-    def get_classification(self, file_path, return_spectrogram=False):
-        fp, outputs, spectrogram = self.run_detection(file_path, return_spectrogram)
-
-        class_bbox = merge_images(fp, outputs, self.config.num_classes)
-        output = {
+    def to_output(self, fp, outputs) -> dict:
+        """
+        Merges the detections of `run_detection` into lists per bird name.
+        """
+        with record_function("merge_images"):
+            class_bbox = merge_images(fp, outputs, self.config.num_classes)
+        return {
             self.reverse_bird_dict[idx]: {
                 key: value.cpu().numpy().tolist()
                 for key, value in class_bbox[str(idx)].items()
@@ -67,8 +85,109 @@ class ModelServer:
             if len(class_bbox[str(idx)]["bbox_coord"]) > 0
         }
 
+    def run_segments(self, file_path, segments, return_spectrogram=False):
+        """
+        Runs the detection on the active segments of a recording only.
+
+        Each segment is written to a temporary WAV file, and the time coordinates
+        of its boxes (x0 and x1) are shifted back to the recording timeline.
+
+        Args:
+            file_path (str): The path of the audio file.
+            segments (list): The (start, end) seconds of the segments.
+            return_spectrogram (bool): Whether to return the spectrogram of the
+                                       recording, blank outside of the segments.
+
+        Returns:
+            Tuple[dict, np.ndarray]: The detections per bird name and the spectrogram
+                                     (None unless requested).
+        """
+        output = {}
+        columns = []
+        width = 0
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for index, (start, end) in enumerate(segments):
+                segment_path = os.path.join(tmp_dir, f"segment_{index}.wav")
+                self.prefilter.write_segment(file_path, start, end, segment_path)
+                fp, outputs, spectrogram = self.run_detection(
+                    segment_path, return_spectrogram=True
+                )
+                spectrogram = spectrogram_to_array(spectrogram)
+                columns_per_second = (
+                    self.prefilter.columns_per_second
+                    or spectrogram.shape[-1] / (end - start)
+                )
+                offset = int(round(start * columns_per_second))
+
+                for bird_name, detections in self.to_output(fp, outputs).items():
+                    merged = output.setdefault(bird_name, {})
+                    for key, values in detections.items():
+                        if key == "bbox_coord":
+                            values = [
+                                [x0 + offset, y0, x1 + offset, y1]
+                                for x0, y0, x1, y1 in values
+                            ]
+                        merged.setdefault(key, []).extend(values)
+
+                if return_spectrogram:
+                    # Inactive audio is left blank, at the lowest level of the segment
+                    if offset > width:
+                        columns.append(
+                            np.full(
+                                (spectrogram.shape[0], offset - width),
+                                spectrogram.min(),
+                                dtype=np.float32,
+                            )
+                        )
+                        width = offset
+                    spectrogram = spectrogram[:, width - offset :]
+                    columns.append(spectrogram)
+                    width += spectrogram.shape[-1]
+
+        if return_spectrogram:
+            return output, np.concatenate(columns, axis=-1)
+        return output, None
+
+    def get_classification(self, file_path, return_spectrogram=False):
+        # Only the active segments found by the prefilter reach the model, unless
+        # they cover most of the recording, where one pass over the file is cheaper
+        self.prefilter_report = None
+        if self.prefilter is not None:
+            report = self.prefilter.scan(file_path)
+            self.prefilter_report = report
+            active_seconds = sum(end - start for start, end in report["segments"])
+            report["skipped_seconds"] = report["duration_seconds"] - active_seconds
+
+            if not report["segments"] and not return_spectrogram:
+                report["mode"] = "skipped"
+                logger.info("No bird activity detected, skipping run_detection")
+                return {}
+            if (
+                report["segments"]
+                and active_seconds
+                < self.prefilter.max_active_fraction * report["duration_seconds"]
+            ):
+                report["mode"] = "segments"
+                logger.info(
+                    f"Running detection on {len(report['segments'])} segments "
+                    f"({active_seconds:.1f}/{report['duration_seconds']:.1f} seconds)"
+                )
+                output, spectrogram = self.run_segments(
+                    file_path, report["segments"], return_spectrogram
+                )
+                logger.info(f"[output]: \n{output}")
+                if return_spectrogram:
+                    return output, spectrogram
+                return output
+
+            report["mode"] = "full"
+            report["skipped_seconds"] = 0.0
+
+        fp, outputs, spectrogram = self.run_detection(file_path, return_spectrogram)
+        output = self.to_output(fp, outputs)
+
         logger.info(f"[output]: \n{output}")
         if return_spectrogram:
-            visualise_model_out(output, fp, spectrogram, self.reverse_bird_dict)
-            # TODO: enregistrer le spectrogram
+            # Rendering is left to the render workers (see model_serve.render)
+            return output, spectrogram
         return output
@@ -0,0 +1,220 @@
+import numpy as np
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+
+class ActivityPrefilter:
+    """
+    A cheap detector of candidate bird activity, run before the DETR forward pass.
+
+    The recording is cut into fixed windows. A window is active if at least one of
+    its STFT frames has enough energy in the bird band and a tonal peak: in one of
+    the sub-bands of the bird band, the peak power stands `peak_ratio_db` above the
+    median power of the sub-band. Power spectra are first averaged over
+    `smoothing_seconds`, which keeps the ratio of broadband noise (wind, rain,
+    traffic) low whatever its spectral slope, while bird calls keep their peak.
+
+    Only the active windows, padded by `padding_seconds` and merged into segments,
+    need to go through the model (see `ModelServer.get_classification`).
+
+    The defaults were calibrated on `api/Turdus_merlula.wav` (about 18-20 dB on the
+    call) against white, pink, brown, wind-like and rain-like noise (at most about
+    11 dB over 10 minutes), at 22.05, 44.1 and 48 kHz.
+    """
+
+    def __init__(
+        self,
+        window_seconds=1.0,
+        band_hz=(1000, 10000),
+        energy_threshold_db=-70.0,
+        peak_ratio_db=14.0,
+        sub_band_hz=500,
+        frame_seconds=0.023,
+        smoothing_seconds=0.1,
+        padding_seconds=1.0,
+        max_active_fraction=0.8,
+        columns_per_second=0.0,
+        chunk_seconds=10.0,
+        frames_per_block=4096,
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.band_hz = band_hz
+        self.energy_threshold_db = energy_threshold_db
+        self.peak_ratio_db = peak_ratio_db
+        self.sub_band_hz = sub_band_hz
+        self.frame_seconds = frame_seconds
+        self.smoothing_seconds = smoothing_seconds
+        self.padding_seconds = padding_seconds
+        self.max_active_fraction = max_active_fraction
+        # Spectrogram columns per audio second of the model, to shift the detections
+        # of a segment back to the recording timeline (measured per segment if 0)
+        self.columns_per_second = columns_per_second
+        self.chunk_seconds = chunk_seconds
+        self.frames_per_block = frames_per_block
+
+    def frame_length(self, sample_rate) -> int:
+        """Returns the STFT size: the power of two closest to `frame_seconds`."""
+        return 2 ** int(round(np.log2(self.frame_seconds * sample_rate)))
+
+    def frame_activity(self, samples, sample_rate) -> np.ndarray:
+        """
+        Flags the STFT frames with candidate bird activity.
+
+        Frames are processed by blocks to bound the memory used by long recordings.
+
+        Args:
+            samples (np.ndarray): The mono audio samples, in [-1, 1].
+            sample_rate (int): The sample rate of the samples.
+
+        Returns:
+            np.ndarray: A boolean array with one value per frame (hop of half a frame).
+        """
+        n_fft = self.frame_length(sample_rate)
+        hop_length = n_fft // 2
+        window = np.hanning(n_fft).astype(np.float32)
+        smoothing = max(1, int(round(self.smoothing_seconds * sample_rate / hop_length)))
+
+        if samples.size < n_fft:
+            samples = np.pad(samples, (0, n_fft - samples.size))
+        frames = sliding_window_view(samples, n_fft)[::hop_length]
+
+        frequencies = np.fft.rfftfreq(n_fft, 1 / sample_rate)
+        band = np.flatnonzero(
+            (frequencies >= self.band_hz[0]) & (frequencies <= self.band_hz[1])
+        )
+        bins_per_sub_band = min(
+            len(band), max(1, int(round(self.sub_band_hz * n_fft / sample_rate)))
+        )
+        band = band[: len(band) // bins_per_sub_band * bins_per_sub_band]
+        # Scaled so that a full-scale sinusoid has a band energy of about -3 dB
+        scale = 2 / window.sum()
+
+        activity = []
+        previous = np.empty((0, len(band)))
+        for start in range(0, len(frames), self.frames_per_block):
+            block = frames[start : start + self.frames_per_block] * window
+            power = (np.abs(np.fft.rfft(block, axis=1)[:, band]) * scale) ** 2 / 2
+            power += 1e-12
+            energy_db = 10 * np.log10(power.sum(axis=1))
+
+            # Moving average over the last `smoothing` frames, continued across blocks
+            extended = np.concatenate([previous, power])
+            cumulative = np.concatenate(
+                [np.zeros((1, len(band))), np.cumsum(extended, axis=0)]
+            )
+            ends = np.arange(len(previous) + 1, len(extended) + 1)
+            starts = np.maximum(ends - smoothing, 0)
+            smoothed = (cumulative[ends] - cumulative[starts]) / (ends - starts)[:, None]
+            previous = extended[len(extended) - (smoothing - 1) :]
+
+            sub_bands = smoothed.reshape(len(smoothed), -1, bins_per_sub_band)
+            peak_ratio = sub_bands.max(axis=2) / np.median(sub_bands, axis=2)
+            peak_ratio_db = 10 * np.log10(peak_ratio.max(axis=1))
+            activity.append(
+                (energy_db > self.energy_threshold_db)
+                & (peak_ratio_db > self.peak_ratio_db)
+            )
+        return np.concatenate(activity)
+
+    def window_activity(self, samples, sample_rate) -> np.ndarray:
+        """
+        Flags the windows with candidate bird activity.
+
+        Returns:
+            np.ndarray: A boolean array with one value per window.
+        """
+        frame_activity = self.frame_activity(samples, sample_rate)
+        hop_length = self.frame_length(sample_rate) // 2
+        frames_per_window = max(
+            1, int(round(self.window_seconds * sample_rate / hop_length))
+        )
+        n_windows = -(-len(frame_activity) // frames_per_window)
+        padded = np.zeros(n_windows * frames_per_window, dtype=bool)
+        padded[: len(frame_activity)] = frame_activity
+        return padded.reshape(n_windows, frames_per_window).any(axis=1)
+
+    def active_segments(self, active, duration_seconds) -> list:
+        """
+        Merges the active windows into padded segments.
+
+        Args:
+            active (np.ndarray): One boolean per window, as returned by `window_activity`.
+            duration_seconds (float): The duration of the recording.
+
+        Returns:
+            list: The (start, end) seconds of the segments, sorted and non-overlapping.
+        """
+        segments = []
+        for window in np.flatnonzero(active):
+            start = max(0.0, float(window) * self.window_seconds - self.padding_seconds)
+            end = min(
+                duration_seconds,
+                float(window + 1) * self.window_seconds + self.padding_seconds,
+            )
+            if segments and start <= segments[-1][1]:
+                segments[-1] = (segments[-1][0], end)
+            else:
+                segments.append((start, end))
+        return segments
+
+    def scan(self, file_path) -> dict:
+        """
+        Scans an audio file for candidate bird activity.
+
+        The file is read by chunks of `chunk_seconds`, so that long recordings are
+        never fully decoded in memory.
+
+        Args:
+            file_path (str): The path of the audio file.
+
+        Returns:
+            dict: The number of `windows` and `active_windows`, the `duration_seconds`
+                  of the file and its active `segments` (see `active_segments`).
+        """
+        info = sf.info(file_path)
+        windows_per_chunk = max(1, int(round(self.chunk_seconds / self.window_seconds)))
+        chunk_frames = int(round(windows_per_chunk * self.window_seconds * info.samplerate))
+
+        active = [
+            self.window_activity(chunk.mean(axis=1), info.samplerate)
+            for chunk in sf.blocks(
+                file_path, blocksize=chunk_frames, dtype="float32", always_2d=True
+            )
+        ]
+        active = np.concatenate(active) if active else np.zeros(0, dtype=bool)
+        duration_seconds = info.frames / info.samplerate
+
+        report = {
+            "windows": int(active.size),
+            "active_windows": int(active.sum()),
+            "duration_seconds": duration_seconds,
+            "segments": self.active_segments(active, duration_seconds),
+        }
+        logger.info(
+            f"Prefilter on {file_path.split('/')[-1]}: "
+            f"{report['active_windows']}/{report['windows']} active windows, "
+            f"{len(report['segments'])} segments"
+        )
+        return report
+
+    def write_segment(self, file_path, start, end, segment_path) -> None:
+        """
+        Writes the [start, end) seconds of an audio file to a WAV file.
+        """
+        info = sf.info(file_path)
+        samples, sample_rate = sf.read(
+            file_path,
+            start=int(round(start * info.samplerate)),
+            stop=int(round(end * info.samplerate)),
+            dtype="float32",
+        )
+        sf.write(segment_path, samples, sample_rate, subtype=info.subtype)
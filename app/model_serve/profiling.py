@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from torch.profiler import ProfilerActivity, profile
+
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    """
+    A minimal Python sampling profiler.
+
+    A background thread periodically captures the stack of the profiled thread and
+    counts identical stacks. The result is written in the "folded stacks" format
+    understood by flamegraph tools (flamegraph.pl, speedscope, inferno...).
+    """
+
+    def __init__(self, interval=0.005) -> None:
+        self.interval = interval
+        self.counts = Counter()
+        self._target_thread_id = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._target_thread_id = threading.get_ident()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            self.counts[";".join(reversed(stack))] += 1
+
+    def to_folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.counts.items())
+
+
+@contextmanager
+def profile_pipeline(output_dir, name, sample_interval=0.005):
+    """
+    Profiles the enclosed code with both the torch profiler and a Python stack sampler.
+
+    The torch profiler records the `run_detection` / `merge_images` ranges emitted by
+    `ModelServer` along with the torch operators, while the sampler captures the
+    Python side (audio decoding, spectrogram computation, post-processing).
+
+    Args:
+        output_dir (str): Directory where the profiling files are written.
+        name (str): Prefix of the profiling files, e.g. the ticket number.
+        sample_interval (float, optional): Stack sampling interval in seconds.
+
+    Yields:
+        dict: A report filled on exit with `trace_path` (Chrome trace, viewable in
+              chrome://tracing or Perfetto), `stacks_path` (folded stacks for
+              flamegraphs) and `summary` (the torch operators table).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    report = {}
+    sampler = StackSampler(sample_interval)
+
+    with profile(activities=[ProfilerActivity.CPU]) as torch_profiler:
+        sampler.start()
+        try:
+            yield report
+        finally:
+            sampler.stop()
+
+    report["trace_path"] = os.path.join(output_dir, f"{name}_trace.json")
+    torch_profiler.export_chrome_trace(report["trace_path"])
+
+    report["stacks_path"] = os.path.join(output_dir, f"{name}_stacks.txt")
+    with open(report["stacks_path"], "w") as file:
+        file.write(sampler.to_folded())
+
+    report["summary"] = torch_profiler.key_averages().table(
+        sort_by="cpu_time_total", row_limit=15
+    )
+    logger.info(
+        f"Profiling files written: {report['trace_path']}, {report['stacks_path']}"
+    )
@@ -0,0 +1,166 @@
+import os
+import time
+from collections import OrderedDict, defaultdict, deque
+
+from model_serve.model_serve import ModelServer, WEIGHTS_PATH
+
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_ID = "default"
+
+
+def parse_model_paths(value) -> dict:
+    """
+    Parses the model routing table from a `model_id=weights_path,...` string.
+
+    Args:
+        value (str): The routing table, e.g. `default=models/a,fr-alps=models/b`.
+                     If empty, only the default model is served.
+
+    Returns:
+        dict: A dictionary mapping model IDs to weights paths.
+    """
+    if not value:
+        return {DEFAULT_MODEL_ID: WEIGHTS_PATH}
+    model_paths = {}
+    for entry in value.split(","):
+        model_id, weights_path = entry.split("=", 1)
+        model_paths[model_id.strip()] = weights_path.strip()
+    return model_paths
+
+
+class ModelMetrics:
+    """
+    Per-model serving metrics: cache hits and misses, loads, evictions, latencies
+    and the audio scanned and skipped by the activity prefilter.
+    """
+
+    def __init__(self, window=1000) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        self.scanned_seconds = 0.0
+        self.skipped_seconds = 0.0
+        self.skipped_files = 0
+        self.latencies = deque(maxlen=window)
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def latency_percentile(self, percentile) -> float:
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+    def to_dict(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+            "evictions": self.evictions,
+            "load_seconds": round(self.load_seconds, 3),
+            "latency_p50": round(self.latency_percentile(0.5), 3),
+            "latency_p95": round(self.latency_percentile(0.95), 3),
+            "prefilter_scanned_seconds": round(self.scanned_seconds, 1),
+            "prefilter_skipped_seconds": round(self.skipped_seconds, 1),
+            "prefilter_skipped_files": self.skipped_files,
+        }
+
+
+class ModelRegistry:
+    """
+    Routes classification requests to the right `ModelServer`.
+
+    Loaded models are kept in an LRU cache bounded by a memory budget: when loading
+    a model would exceed the budget, the least recently used models are evicted.
+    Models loaded before the worker processes are forked (see `preload`) share
+    their weights copy-on-write with every worker.
+    """
+
+    def __init__(
+        self, model_paths, bird_dict, memory_budget_mb=2048, prefilter=None
+    ) -> None:
+        self.model_paths = model_paths
+        self.bird_dict = bird_dict
+        self.prefilter = prefilter
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.models = OrderedDict()
+        self.metrics = defaultdict(ModelMetrics)
+
+    def memory_usage(self) -> int:
+        return sum(model.memory_footprint() for model in self.models.values())
+
+    def preload(self, model_ids) -> None:
+        for model_id in model_ids:
+            self.get(model_id)
+
+    def get(self, model_id) -> ModelServer:
+        """
+        Returns the loaded `ModelServer` of a model, loading it if necessary.
+
+        Args:
+            model_id (str): The model ID, as declared in the routing table.
+
+        Returns:
+            ModelServer: The loaded model server.
+
+        Raises:
+            KeyError: If the model ID is not in the routing table.
+        """
+        if model_id not in self.model_paths:
+            raise KeyError(f"Unknown model ID: {model_id}")
+
+        metrics = self.metrics[model_id]
+        if model_id in self.models:
+            metrics.hits += 1
+            self.models.move_to_end(model_id)
+            return self.models[model_id]
+
+        metrics.misses += 1
+        logger.info(f"[pid {os.getpid()}] Loading model '{model_id}'...")
+        start = time.perf_counter()
+        model = ModelServer(
+            self.model_paths[model_id], dict(self.bird_dict), self.prefilter
+        )
+        model.load()
+        model.model.eval()
+        metrics.load_seconds += time.perf_counter() - start
+
+        self.models[model_id] = model
+        self._evict(keep=model_id)
+        return model
+
+    def _evict(self, keep) -> None:
+        while self.memory_usage() > self.memory_budget and len(self.models) > 1:
+            model_id = next(iter(self.models))
+            if model_id == keep:
+                break
+            del self.models[model_id]
+            self.metrics[model_id].evictions += 1
+            logger.info(
+                f"[pid {os.getpid()}] Evicted model '{model_id}' (memory budget exceeded)"
+            )
+
+    def record_latency(self, model_id, seconds, prefilter_report=None) -> None:
+        metrics = self.metrics[model_id]
+        metrics.latencies.append(seconds)
+        if prefilter_report is not None:
+            metrics.scanned_seconds += prefilter_report["duration_seconds"]
+            # Only audio that never reached the model counts as skipped
+            metrics.skipped_seconds += prefilter_report["skipped_seconds"]
+            if prefilter_report["mode"] == "skipped":
+                metrics.skipped_files += 1
+        logger.info(
+            f"[pid {os.getpid()}] Model '{model_id}' metrics: {self.metrics[model_id].to_dict()}"
+        )
@@ -0,0 +1,172 @@
+import io
+import multiprocessing
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+from matplotlib.patches import Rectangle  # noqa: E402
+
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+
+def spectrogram_to_array(spectrogram) -> np.ndarray:
+    """
+    Converts the spectrogram returned by `run_detection` into a 2D numpy array.
+
+    Torch tensors are moved to the CPU, and chunked spectrograms (a list of chunks
+    or a 3D stack of chunks) are concatenated along the time axis.
+
+    Args:
+        spectrogram (Union[torch.Tensor, np.ndarray, list]): The spectrogram to convert.
+
+    Returns:
+        np.ndarray: A (frequency, time) float32 array.
+    """
+    if hasattr(spectrogram, "cpu"):
+        spectrogram = spectrogram.cpu().numpy()
+    if isinstance(spectrogram, (list, tuple)):
+        return np.concatenate(
+            [spectrogram_to_array(chunk) for chunk in spectrogram], axis=-1
+        )
+
+    array = np.squeeze(np.asarray(spectrogram, dtype=np.float32))
+    if array.ndim == 3:
+        array = np.concatenate(list(array), axis=-1)
+    return array
+
+
+def encode_spectrogram(spectrogram) -> bytes:
+    """
+    Serializes a spectrogram to `.npy` bytes so it can be cached in MinIO.
+
+    Args:
+        spectrogram (Union[torch.Tensor, np.ndarray, list]): The spectrogram to serialize.
+
+    Returns:
+        bytes: The `.npy` encoded spectrogram.
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, spectrogram_to_array(spectrogram), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_spectrogram(data) -> np.ndarray:
+    """
+    Deserializes a spectrogram produced by `encode_spectrogram`.
+
+    Args:
+        data (bytes): The `.npy` encoded spectrogram.
+
+    Returns:
+        np.ndarray: The spectrogram array.
+    """
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class SpectrogramRenderer:
+    """
+    Renders spectrograms with their detections as PNG images.
+
+    A single figure is created once and cleared between renders, so that a
+    long-lived render worker does not pay the figure setup cost for every image.
+    """
+
+    def __init__(self, figsize=(12, 4), dpi=100) -> None:
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(111)
+
+    def render(self, spectrogram, detections) -> bytes:
+        """
+        Renders a spectrogram and draws the detected bounding boxes over it.
+
+        Args:
+            spectrogram (np.ndarray): The (frequency, time) spectrogram.
+            detections (dict): The classification output, mapping bird names to
+                               their `bbox_coord` and `scores` lists.
+
+        Returns:
+            bytes: The rendered PNG image.
+        """
+        self.ax.clear()
+        self.ax.imshow(spectrogram, aspect="auto", cmap="magma")
+
+        for idx, (bird_name, detection) in enumerate(detections.items()):
+            color = f"C{idx % 10}"
+            for (x0, y0, x1, y1), score in zip(
+                detection["bbox_coord"], detection["scores"]
+            ):
+                self.ax.add_patch(
+                    Rectangle(
+                        (x0, y0),
+                        x1 - x0,
+                        y1 - y0,
+                        fill=False,
+                        edgecolor=color,
+                        linewidth=1.5,
+                    )
+                )
+                self.ax.text(
+                    x0, y0, f"{bird_name} {score:.2f}", color=color, fontsize=7
+                )
+
+        self.ax.set_xlabel("Time (frames)")
+        self.ax.set_ylabel("Frequency (bins)")
+
+        buffer = io.BytesIO()
+        self.figure.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+
+
+# One renderer per pool process, created by the pool initializer
+_renderer = None
+
+
+def _init_render_worker() -> None:
+    global _renderer
+    _renderer = SpectrogramRenderer()
+
+
+def _render(spectrogram_data, detections) -> bytes:
+    return _renderer.render(decode_spectrogram(spectrogram_data), detections)
+
+
+class RenderPool:
+    """
+    A small process pool rendering spectrogram images off the inference path.
+    """
+
+    def __init__(self, processes=2) -> None:
+        logger.info(f"Starting render pool with {processes} processes...")
+        self.pool = multiprocessing.Pool(processes, initializer=_init_render_worker)
+
+    def submit(self, spectrogram_data, detections, callback, error_callback) -> None:
+        """
+        Schedules a render job.
+
+        Args:
+            spectrogram_data (bytes): The `.npy` encoded spectrogram.
+            detections (dict): The classification output to draw.
+            callback (function): Called with the PNG bytes once rendered.
+            error_callback (function): Called with the exception if rendering fails.
+        """
+        self.pool.apply_async(
+            _render,
+            (spectrogram_data, detections),
+            callback=callback,
+            error_callback=error_callback,
+        )
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
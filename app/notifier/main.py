@@ -0,0 +1,378 @@
+import os
+import json
+import time
+import socket
+from concurrent.futures import ThreadPoolExecutor
+import pika
+from minio import Minio
+from minio.error import S3Error
+
+from app_utils.rabbitmq import RETRY_HEADER, get_rabbit_connection
+from app_utils.minio import (
+    read_file_from_minio,
+    write_file_to_minio,
+    write_file_to_minio_if,
+)
+from app_utils.smtplib import (
+    MAX_ATTACHMENT_BYTES,
+    build_failure_email,
+    build_results_email,
+    send_messages,
+)
+
+
+import logging
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+
+#################### CONFIG ####################
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
+FEEDBACK_QUEUE = os.getenv("RABBITMQ_QUEUE_INF2API")
+DEAD_LETTER_QUEUE = os.getenv("RABBITMQ_QUEUE_NOTIFIER_DLQ", f"{FEEDBACK_QUEUE}_dead_letter")
+
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
+MINIO_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
+MINIO_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+MINIO_BUCKET = os.getenv("MINIO_BUCKET")
+
+NOTIFIER_PREFETCH = int(os.getenv("NOTIFIER_PREFETCH", "200"))
+NOTIFIER_BATCH_SIZE = int(os.getenv("NOTIFIER_BATCH_SIZE", "50"))
+NOTIFIER_BATCH_WINDOW = float(os.getenv("NOTIFIER_BATCH_WINDOW", "1.0"))
+NOTIFIER_FETCH_CONCURRENCY = int(os.getenv("NOTIFIER_FETCH_CONCURRENCY", "16"))
+NOTIFIER_RETRY_DELAY = float(os.getenv("NOTIFIER_RETRY_DELAY", "5"))
+NOTIFIER_MAX_RETRIES = int(os.getenv("NOTIFIER_MAX_RETRIES", "5"))
+NOTIFIER_CLAIM_TTL = float(os.getenv("NOTIFIER_CLAIM_TTL", "300"))
+
+#################### STORAGE ####################
+minio_client = Minio(
+    MINIO_ENDPOINT,
+    access_key=MINIO_ACCESS_KEY,
+    secret_key=MINIO_SECRET_KEY,
+    secure=False,
+)
+
+
+#################### IDEMPOTENCY ####################
+# Identifies this replica in the claims written before sending an email
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def delivery_marker(notification) -> str:
+    return f"notifications/{notification['ticket_number']}_{notification.get('status', 'done')}"
+
+
+def read_marker(notification):
+    """
+    Reads the delivery marker of a notification.
+
+    The marker is `{"state": "sending", "owner": ..., "claimed_at": ...}` while a
+    replica sends the email, then `{"state": "sent", ...}` once it is sent. Its
+    `etag` is added, to replace it only if it did not change since (see `claim`).
+
+    Returns:
+        Optional[dict]: The marker, or None if the notification was never claimed.
+
+    Raises:
+        S3Error: If the marker could not be read for another reason than its absence.
+    """
+    try:
+        response = minio_client.get_object(MINIO_BUCKET, delivery_marker(notification))
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+    try:
+        marker = json.loads(response.read())
+        marker["etag"] = response.headers.get("ETag")
+    finally:
+        response.close()
+        response.release_conn()
+    # Markers written before claims were introduced only mark sent emails
+    marker.setdefault("state", "sent")
+    return marker
+
+
+def marker_data(notification, state) -> bytes:
+    return json.dumps(
+        {
+            "state": state,
+            "owner": OWNER,
+            "claimed_at": time.time(),
+            "email": notification["email"],
+        }
+    ).encode("utf-8")
+
+
+def claim(notification, redelivered) -> bool:
+    """
+    Claims a notification before sending its email, so that redelivered or
+    duplicated feedback messages, on this replica or another one, are not sent twice.
+
+    A claim held by another replica is taken over when it is older than
+    `NOTIFIER_CLAIM_TTL`, or when the message was redelivered (its previous consumer
+    stopped before acknowledging it, most likely while holding the claim).
+
+    Claims are conditional writes: the marker is created only if absent, and taken
+    over only if unchanged since it was read, so two replicas never both own a
+    notification.
+
+    Returns:
+        bool: True if this replica now owns the notification.
+    """
+    marker = read_marker(notification)
+    etag = None
+    if marker is not None:
+        if marker["state"] == "sent":
+            return False
+        claimed_by_other = marker.get("owner") != OWNER
+        fresh = time.time() - marker.get("claimed_at", 0) < NOTIFIER_CLAIM_TTL
+        if claimed_by_other and fresh and not redelivered:
+            return False
+        etag = marker["etag"]
+    written = write_file_to_minio_if(
+        minio_client,
+        MINIO_BUCKET,
+        delivery_marker(notification),
+        marker_data(notification, "sending"),
+        etag=etag,
+    )
+    return written is not None
+
+
+def mark_delivered(notification) -> None:
+    # The email is sent: a failure here must not requeue it, only log
+    try:
+        write_file_to_minio(
+            minio_client,
+            MINIO_BUCKET,
+            delivery_marker(notification),
+            marker_data(notification, "sent"),
+        )
+    except Exception as e:
+        logger.error(
+            f"Failed to mark ticket #{notification['ticket_number']} as delivered, "
+            f"its email is sent again if its claim expires: {str(e)}"
+        )
+
+
+def release(notification) -> None:
+    # Lets another replica retry right away instead of waiting for the claim to expire
+    try:
+        minio_client.remove_object(MINIO_BUCKET, delivery_marker(notification))
+    except Exception as e:
+        logger.error(
+            f"Failed to release ticket #{notification['ticket_number']}: {str(e)}"
+        )
+
+
+#################### EMAILS ####################
+def build_email(notification):
+    """
+    Builds the email of a notification, fetching the results to attach from MinIO.
+
+    Returns:
+        The email message, or None if the results could not be fetched.
+    """
+    email = notification["email"]
+    ticket_number = notification["ticket_number"]
+    if notification.get("status") == "failed":
+        return build_failure_email(email, ticket_number, notification.get("error", ""))
+
+    # Results are stored per ticket: the legacy `json_minio_path` is named after the
+    # WAV file, which /upload-dev shares between tickets
+    results_minio_path = notification["results_minio_path"]
+    try:
+        size = minio_client.stat_object(MINIO_BUCKET, results_minio_path).size
+    except Exception as e:
+        logger.error(
+            f"Failed to stat results file '{results_minio_path}' in MinIO: {str(e)}"
+        )
+        return None
+
+    json_data = None
+    if size <= MAX_ATTACHMENT_BYTES:
+        json_data = read_file_from_minio(minio_client, MINIO_BUCKET, results_minio_path)
+        if json_data is None:
+            return None
+    return build_results_email(email, ticket_number, json_data)
+
+
+def required_keys(notification) -> tuple:
+    if notification.get("status") == "failed":
+        return ("email", "ticket_number")
+    return ("email", "ticket_number", "results_minio_path")
+
+
+def parse_notification(body) -> dict:
+    """
+    Parses a feedback message.
+
+    Raises:
+        ValueError: If the message is not a JSON object with all the keys its email needs.
+    """
+    notification = json.loads(body)
+    if not isinstance(notification, dict):
+        raise ValueError("not a JSON object")
+    missing = [key for key in required_keys(notification) if not notification.get(key)]
+    if missing:
+        raise ValueError(f"missing keys {missing}")
+    return notification
+
+
+def prepare_notification(body, redelivered) -> tuple:
+    """
+    Parses a feedback message, claims it and builds its email.
+
+    Never raises: a message that fails unexpectedly is `unavailable`, and retried.
+
+    Returns:
+        tuple: The (state, notification, email message) of the message, the state
+               being `ready`, `skipped` (already delivered, or claimed by another
+               replica), `unavailable` (results or markers not readable yet) or
+               `malformed`.
+    """
+    try:
+        notification = parse_notification(body)
+    except Exception as e:
+        logger.error(f"Malformed feedback message {body!r}: {str(e)}")
+        return "malformed", None, None
+
+    ticket_number = notification["ticket_number"]
+    try:
+        if not claim(notification, redelivered):
+            logger.info(
+                f"Notification for ticket #{ticket_number} delivered or claimed, skipping"
+            )
+            return "skipped", notification, None
+    except Exception as e:
+        logger.error(f"Failed to claim notification for ticket #{ticket_number}: {str(e)}")
+        return "unavailable", notification, None
+
+    try:
+        message = build_email(notification)
+    except Exception as e:
+        logger.error(f"Failed to build email of ticket #{ticket_number}: {str(e)}")
+        message = None
+    if message is None:
+        release(notification)
+        return "unavailable", notification, None
+
+    return "ready", notification, message
+
+
+def retry_later(channel, properties, body, error, retryable=True) -> None:
+    """
+    Republishes a feedback message at the end of the queue with its `x-retry-count`
+    header incremented, or moves it to the dead-letter queue once it failed more
+    than `NOTIFIER_MAX_RETRIES` times (or right away if not retryable).
+    """
+    headers = dict(properties.headers or {})
+    retry_count = headers.get(RETRY_HEADER, 0) + 1
+    headers[RETRY_HEADER] = retry_count
+    headers["x-last-error"] = error
+
+    if retryable and retry_count <= NOTIFIER_MAX_RETRIES:
+        logger.warning(
+            f"Notification failed ({error}), retrying ({retry_count}/{NOTIFIER_MAX_RETRIES})"
+        )
+        queue = FEEDBACK_QUEUE
+    else:
+        logger.error(f"Notification failed ({error}), moving it to {DEAD_LETTER_QUEUE}")
+        queue = DEAD_LETTER_QUEUE
+    channel.basic_publish(
+        exchange="",
+        routing_key=queue,
+        body=body,
+        properties=pika.BasicProperties(headers=headers),
+    )
+
+
+def process_batch(channel, batch, executor) -> None:
+    """
+    Sends the emails of a batch of feedback messages.
+
+    Messages are claimed and their results fetched concurrently, the emails are sent
+    over a single SMTP connection, then the delivery markers are written. Every
+    message is acknowledged: those whose email could not be built or sent are first
+    republished for a later retry (see `retry_later`).
+    """
+    prepared = executor.map(
+        prepare_notification,
+        [body for _, _, body in batch],
+        [method.redelivered for method, _, _ in batch],
+    )
+
+    to_send = []
+    seen = set()
+    for (method, properties, body), (state, notification, message) in zip(
+        batch, prepared
+    ):
+        if state == "ready" and delivery_marker(notification) not in seen:
+            seen.add(delivery_marker(notification))
+            to_send.append((method, properties, body, notification, message))
+            continue
+        if state == "malformed":
+            retry_later(channel, properties, body, "malformed message", retryable=False)
+        elif state == "unavailable":
+            retry_later(channel, properties, body, "results or marker not readable")
+        # Skipped, or duplicated within the batch
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    sent = send_messages([message for *_, message in to_send])
+    delivered = [
+        notification
+        for (*_, notification, _), success in zip(to_send, sent)
+        if success
+    ]
+    list(executor.map(mark_delivered, delivered))
+
+    for (method, properties, body, notification, _), success in zip(to_send, sent):
+        if not success:
+            release(notification)
+            retry_later(channel, properties, body, "email not sent")
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    logger.info(f"Batch processed: {len(delivered)}/{len(batch)} emails sent")
+    if to_send and not delivered:
+        # No email went through: let the SMTP server recover before the next batch
+        time.sleep(NOTIFIER_RETRY_DELAY)
+
+
+#################### MAIN LOOP ####################
+if __name__ == "__main__":
+    rabbitmq_connection = get_rabbit_connection(RABBITMQ_HOST, RABBITMQ_PORT)
+    rabbitmq_channel = rabbitmq_connection.channel()
+
+    logging.info(f"Declaring queue: {FEEDBACK_QUEUE}")
+    rabbitmq_channel.queue_declare(queue=FEEDBACK_QUEUE)
+    logging.info(f"Declaring dead-letter queue: {DEAD_LETTER_QUEUE}")
+    rabbitmq_channel.queue_declare(queue=DEAD_LETTER_QUEUE)
+    rabbitmq_channel.basic_qos(prefetch_count=NOTIFIER_PREFETCH)
+
+    executor = ThreadPoolExecutor(max_workers=NOTIFIER_FETCH_CONCURRENCY)
+    batch = []
+    batch_started = None
+
+    logger.info(f"Waiting for feedback messages from queue: {FEEDBACK_QUEUE}")
+    for method, properties, body in rabbitmq_channel.consume(
+        FEEDBACK_QUEUE, inactivity_timeout=NOTIFIER_BATCH_WINDOW
+    ):
+        if method is not None:
+            if not batch:
+                batch_started = time.monotonic()
+            batch.append((method, properties, body))
+
+        # Flush when the batch is full, or when its oldest message waited long enough
+        if batch and (
+            len(batch) >= NOTIFIER_BATCH_SIZE
+            or time.monotonic() - batch_started >= NOTIFIER_BATCH_WINDOW
+        ):
+            process_batch(rabbitmq_channel, batch, executor)
+            batch = []
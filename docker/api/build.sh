@@ -28,9 +28,16 @@ cp -r ../../app/api/. ./api/
 echo "Checking the '/api' content brought to image build context:"
 ls ./api
 
+# Ensure the notifier directory exists
+mkdir -p ./notifier
+# Copy the contents of the notifier directory to the already created destination directory
+cp -r ../../app/notifier/. ./notifier/
+ls ./notifier
+
 # Build the Docker image with the folder name as the tag and the provided Docker Hub account name
 docker build -t "${DOCKER_ACCOUNT}/bird-sound-classif:${FOLDER_NAME}" -f "Dockerfile.${FOLDER_NAME}" --build-arg BASE_IMAGE="${DOCKER_ACCOUNT}/bird-sound-classif:base" .
 
 # Cleanup: Remove copied directories
 rm -rf ./app_utils
 rm -rf ./api
+rm -rf ./notifier
@@ -0,0 +1,364 @@
+"""
+Load generator for the upload -> inference -> email pipeline.
+
+Uploads synthetic WAV clips to `/upload` following a Poisson arrival process,
+follows every ticket on `/results/{ticket_number}` until its results are available,
+samples the inference queue depth from the RabbitMQ management API, and fits a
+capacity model of the inference workers from the measurements.
+
+Usage (against the docker compose stack):
+    python scripts/loadgen.py --rate 0.5 --duration 300 --workers 1 --cores 4
+
+The API URL and the RabbitMQ management URL can point to any deployment,
+e.g. services started locally outside of docker compose (`--rabbitmq-api ""`
+disables the queue depth sampling, and the capacity model is then reported as
+degraded since queueing delays cannot be told apart from service times).
+"""
+import io
+import json
+import math
+import time
+import uuid
+import wave
+import random
+import struct
+import argparse
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+import logging
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 22050
+
+
+#################### SYNTHETIC CLIPS ####################
+def synthetic_wav(seconds, seed) -> bytes:
+    """
+    Generates a mono 16-bit WAV clip of background noise with a few bird-like chirps.
+
+    Args:
+        seconds (float): The clip length.
+        seed (int): The random seed, so that clips are reproducible.
+
+    Returns:
+        bytes: The WAV file content.
+    """
+    rng = random.Random(seed)
+    n_samples = int(seconds * SAMPLE_RATE)
+    samples = [rng.gauss(0.0, 0.02) for _ in range(n_samples)]
+
+    # A chirp every few seconds: a short upward frequency sweep between 2 and 6 kHz
+    chirp_length = int(0.3 * SAMPLE_RATE)
+    for start in range(0, max(n_samples - chirp_length, 0), 3 * SAMPLE_RATE):
+        start += rng.randrange(SAMPLE_RATE)
+        low, high = rng.uniform(2000, 4000), rng.uniform(4000, 6000)
+        for i in range(min(chirp_length, n_samples - start)):
+            t = i / SAMPLE_RATE
+            frequency = low + (high - low) * i / chirp_length
+            envelope = math.sin(math.pi * i / chirp_length)
+            samples[start + i] += 0.5 * envelope * math.sin(2 * math.pi * frequency * t)
+
+    frames = struct.pack(
+        f"<{n_samples}h", *(max(-32767, min(32767, int(s * 32767))) for s in samples)
+    )
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(frames)
+    return buffer.getvalue()
+
+
+def parse_clip_mix(value) -> list:
+    """
+    Parses a clip length mix from a `seconds:weight,...` string, e.g. `5:0.5,30:0.3,120:0.2`.
+    """
+    mix = []
+    for entry in value.split(","):
+        seconds, weight = entry.split(":")
+        mix.append((float(seconds), float(weight)))
+    return mix
+
+
+#################### LOAD ####################
+class LoadRun:
+    """
+    Drives the uploads and collects the per-ticket and queue depth measurements.
+    """
+
+    def __init__(self, args) -> None:
+        self.args = args
+        self.session = requests.Session()
+        self.tickets = []
+        self.queue_depth = []
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.stop_sampling = threading.Event()
+
+    def now(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def follow_ticket(self, seconds, wav_data) -> None:
+        file_name = f"loadgen_{uuid.uuid4().hex}.wav"
+        record = {"clip_seconds": seconds, "submitted": self.now()}
+        try:
+            response = self.session.post(
+                f"{self.args.api_url}/upload",
+                files={"file": (file_name, wav_data, "audio/wav")},
+                data={"email": self.args.email},
+                timeout=60,
+            )
+            response.raise_for_status()
+            ticket_number = response.json()["ticket_number"]
+            record["ticket_number"] = ticket_number
+            record["uploaded"] = self.now()
+
+            deadline = time.monotonic() + self.args.ticket_timeout
+            while time.monotonic() < deadline:
+                response = self.session.get(
+                    f"{self.args.api_url}/results/{ticket_number}",
+                    headers={"Range": "bytes=0-0"},
+                    timeout=30,
+                )
+                if response.status_code in (200, 206):
+                    record["completed"] = self.now()
+                    break
+                time.sleep(self.args.poll_interval)
+            else:
+                record["error"] = "timeout"
+        except Exception as e:
+            record["error"] = str(e)
+
+        with self.lock:
+            self.tickets.append(record)
+
+    def sample_queue_depth(self) -> None:
+        url = f"{self.args.rabbitmq_api}/api/queues/{quote('/', safe='')}/{self.args.queue}"
+        auth = tuple(self.args.rabbitmq_auth.split(":", 1))
+        while not self.stop_sampling.wait(self.args.sample_interval):
+            try:
+                response = requests.get(url, auth=auth, timeout=5)
+                response.raise_for_status()
+                self.queue_depth.append((self.now(), response.json()["messages"]))
+            except Exception as e:
+                logger.warning(f"Failed to sample queue depth: {str(e)}")
+
+    def run(self) -> None:
+        args = self.args
+        rng = random.Random(args.seed)
+        lengths, weights = zip(*parse_clip_mix(args.clip_mix))
+        clips = {seconds: synthetic_wav(seconds, args.seed) for seconds in lengths}
+
+        self.start_time = time.monotonic()
+        sampler = None
+        if args.rabbitmq_api:
+            sampler = threading.Thread(target=self.sample_queue_depth, daemon=True)
+            sampler.start()
+
+        with ThreadPoolExecutor(max_workers=args.max_in_flight) as executor:
+            next_arrival = 0.0
+            while next_arrival < args.duration:
+                time.sleep(max(0.0, next_arrival - self.now()))
+                seconds = rng.choices(lengths, weights)[0]
+                executor.submit(self.follow_ticket, seconds, clips[seconds])
+                next_arrival += rng.expovariate(args.rate)
+            logger.info("All uploads sent, waiting for the remaining tickets...")
+
+        self.stop_sampling.set()
+        if sampler is not None:
+            sampler.join()
+
+
+#################### REPORT ####################
+def percentile(values, fraction) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def depth_at(queue_depth, t) -> int:
+    """Returns the last queue depth sampled before time `t` (0 before the first sample)."""
+    depth = 0
+    for sample_time, sample_depth in queue_depth:
+        if sample_time > t:
+            break
+        depth = sample_depth
+    return depth
+
+
+def fit_capacity(tickets, queue_depth, workers, cores, poll_interval) -> dict:
+    """
+    Fits a capacity model of the inference workers.
+
+    The service time of a clip is modelled as `overhead + per_audio_second * clip_seconds`
+    and fitted by least squares on the end-to-end latency of the tickets that found an
+    empty queue on arrival (no queueing delay; upload, polling and feedback delays are
+    included in the overhead). Completions are observed by polling, so each service
+    time overestimates the real one by up to `poll_interval` seconds. With `workers`
+    consumers sharing `cores` cores, the predicted capacity is
+    `workers / (service_time * cores)` clips per second per core.
+
+    Without queue depth samples, queueing delays cannot be excluded: the model is
+    fitted on every ticket and flagged as degraded. If no ticket found an empty queue,
+    no model is fitted.
+
+    Args:
+        tickets (list): The completed ticket records.
+        queue_depth (list): The (time, depth) queue samples.
+        workers (int): The number of inference consumers (INFERENCE_WORKERS x replicas).
+        cores (int): The number of cores allocated to the inference workers.
+        poll_interval (float): The polling interval of the results, in seconds.
+
+    Returns:
+        dict: The fitted model and its predictions, or the reason why none was fitted.
+    """
+    warnings = [
+        f"service times include up to {poll_interval}s of results polling granularity"
+    ]
+    if queue_depth:
+        unqueued = [
+            ticket
+            for ticket in tickets
+            if depth_at(queue_depth, ticket["uploaded"]) == 0
+        ]
+        if not unqueued:
+            return {
+                "error": "no ticket found an empty queue, lower --rate to measure service times",
+                "warnings": warnings,
+            }
+    else:
+        unqueued = tickets
+        warnings.append(
+            "queue depth not sampled: service times include queueing delays, "
+            "capacity is underestimated"
+        )
+
+    durations = [ticket["clip_seconds"] for ticket in unqueued]
+    service_times = [ticket["completed"] - ticket["uploaded"] for ticket in unqueued]
+
+    if len(set(durations)) > 1:
+        per_audio_second, overhead = statistics.linear_regression(
+            durations, service_times
+        )
+    else:
+        per_audio_second, overhead = 0.0, statistics.mean(service_times)
+
+    mean_clip_seconds = statistics.mean(ticket["clip_seconds"] for ticket in tickets)
+    mean_service_time = max(overhead + per_audio_second * mean_clip_seconds, 1e-6)
+    return {
+        "samples": len(unqueued),
+        "degraded": not queue_depth,
+        "warnings": warnings,
+        "overhead_seconds": overhead,
+        "seconds_per_audio_second": per_audio_second,
+        "mean_clip_seconds": mean_clip_seconds,
+        "mean_service_seconds": mean_service_time,
+        "clips_per_second_per_core": workers / (mean_service_time * cores),
+        "clips_per_second": workers / mean_service_time,
+    }
+
+
+def build_report(load_run, workers, cores, poll_interval) -> dict:
+    tickets = load_run.tickets
+    completed = [ticket for ticket in tickets if "completed" in ticket]
+    report = {
+        "submitted": len(tickets),
+        "completed": len(completed),
+        "failed": len(tickets) - len(completed),
+        "queue_depth": load_run.queue_depth,
+        "tickets": tickets,
+    }
+    if not completed:
+        return report
+
+    latencies = [ticket["completed"] - ticket["submitted"] for ticket in completed]
+    elapsed = max(ticket["completed"] for ticket in completed) - min(
+        ticket["submitted"] for ticket in completed
+    )
+    report.update(
+        {
+            "throughput_clips_per_second": len(completed) / elapsed if elapsed else 0.0,
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_p99": percentile(latencies, 0.99),
+            "latency_max": max(latencies),
+            "max_queue_depth": max(
+                (depth for _, depth in load_run.queue_depth), default=0
+            ),
+            "capacity_model": fit_capacity(
+                completed, load_run.queue_depth, workers, cores, poll_interval
+            ),
+        }
+    )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0].strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--api-url", default="http://localhost:8001")
+    parser.add_argument(
+        "--rabbitmq-api",
+        default="http://localhost:15672",
+        help="RabbitMQ management URL, empty to disable queue depth sampling",
+    )
+    parser.add_argument("--rabbitmq-auth", default="guest:guest")
+    parser.add_argument("--queue", default="api_to_inference")
+    parser.add_argument("--email", default="loadgen@example.com")
+    parser.add_argument("--rate", type=float, default=0.5, help="Uploads per second")
+    parser.add_argument(
+        "--duration", type=float, default=60, help="Duration of the arrivals in seconds"
+    )
+    parser.add_argument(
+        "--clip-mix",
+        default="5:0.5,30:0.3,120:0.2",
+        help="Clip lengths and weights, as seconds:weight,...",
+    )
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="Results polling interval, the resolution of the measured latencies",
+    )
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--ticket-timeout", type=float, default=1800)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of inference consumers"
+    )
+    parser.add_argument(
+        "--cores", type=int, default=1, help="Cores allocated to the inference workers"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadgen_report.json")
+    args = parser.parse_args()
+
+    load_run = LoadRun(args)
+    load_run.run()
+    report = build_report(load_run, args.workers, args.cores, args.poll_interval)
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    summary = {
+        key: value
+        for key, value in report.items()
+        if key not in ("queue_depth", "tickets")
+    }
+    print(json.dumps(summary, indent=2))
+    print(f"Full report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The services import their shared modules as `app_utils.*` from the `app` directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
@@ -0,0 +1,387 @@
+import importlib.util
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pika")
+pytest.importorskip("minio")
+
+from minio.error import S3Error  # noqa: E402
+
+import app_utils.minio as minio_utils  # noqa: E402
+from app_utils.rabbitmq import RETRY_HEADER  # noqa: E402
+
+FEEDBACK_QUEUE = "feedback"
+DEAD_LETTER_QUEUE = "feedback_dead_letter"
+BUCKET = "bucket"
+
+
+@pytest.fixture(scope="module")
+def notifier():
+    # The notifier is a script configured from the environment at import time
+    env = {
+        "RABBITMQ_QUEUE_INF2API": FEEDBACK_QUEUE,
+        "MINIO_ENDPOINT": "localhost:9000",
+        "MINIO_BUCKET": BUCKET,
+        "NOTIFIER_MAX_RETRIES": "2",
+        "NOTIFIER_RETRY_DELAY": "0",
+        "NOTIFIER_CLAIM_TTL": "300",
+    }
+    previous = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        path = os.path.join(os.path.dirname(__file__), "..", "app", "notifier", "main.py")
+        spec = importlib.util.spec_from_file_location("notifier_main", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key)
+            else:
+                os.environ[key] = value
+    return module
+
+
+class FakeResponse:
+    def __init__(self, data, etag) -> None:
+        self.data = data
+        self.headers = {"ETag": etag}
+
+    def read(self):
+        return self.data
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+def no_such_key(name):
+    return S3Error("NoSuchKey", "not found", name, "request", "host", None)
+
+
+class FakeMinio:
+    """An in-memory bucket, with the conditional writes of `write_file_to_minio_if`."""
+
+    def __init__(self) -> None:
+        self.objects = {}
+        self.etags = itertools.count()
+        self.lock = threading.Lock()
+
+    def put(self, name, data):
+        etag = f'"{next(self.etags)}"'
+        self.objects[name] = (data, etag)
+        return etag
+
+    def marker(self, name):
+        return json.loads(self.objects[name][0])
+
+    def get_object(self, bucket_name, name):
+        if name not in self.objects:
+            raise no_such_key(name)
+        return FakeResponse(*self.objects[name])
+
+    def stat_object(self, bucket_name, name):
+        if name not in self.objects:
+            raise no_such_key(name)
+        return SimpleNamespace(size=len(self.objects[name][0]))
+
+    def put_object(self, bucket_name, name, data, length):
+        self.put(name, data.read())
+
+    def remove_object(self, bucket_name, name):
+        self.objects.pop(name, None)
+
+    def write_if(self, minio_client, bucket_name, name, data, etag=None):
+        # Atomic, as on the server
+        with self.lock:
+            current = self.objects.get(name)
+            if (etag is None and current is not None) or (
+                etag is not None and (current is None or current[1] != etag)
+            ):
+                return None
+            return self.put(name, data)
+
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.published = []
+        self.acked = []
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, body, dict(properties.headers or {})))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+
+@pytest.fixture
+def storage(notifier, monkeypatch):
+    fake = FakeMinio()
+    monkeypatch.setattr(notifier, "minio_client", fake)
+    monkeypatch.setattr(notifier, "write_file_to_minio_if", fake.write_if)
+    return fake
+
+
+@pytest.fixture
+def outbox(notifier, monkeypatch):
+    """Records the emails sent, all successfully unless `outbox.fail` is set."""
+    sent = SimpleNamespace(messages=[], fail=False)
+
+    def send_messages(messages):
+        sent.messages.extend(messages)
+        return [not sent.fail] * len(messages)
+
+    monkeypatch.setattr(notifier, "send_messages", send_messages)
+    return sent
+
+
+def feedback(ticket_number="abc123", **overrides):
+    message = {
+        "email": "user@example.com",
+        "ticket_number": ticket_number,
+        "results_minio_path": f"{ticket_number}_results.json",
+        "json_minio_path": "Turdus_merlula.json",
+        "status": "done",
+    }
+    message.update(overrides)
+    return json.dumps(message).encode()
+
+
+def process(notifier, bodies, headers=None, redelivered=False):
+    channel = FakeChannel()
+    batch = [
+        (
+            SimpleNamespace(delivery_tag=tag, redelivered=redelivered),
+            SimpleNamespace(headers=headers),
+            body,
+        )
+        for tag, body in enumerate(bodies, start=1)
+    ]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        notifier.process_batch(channel, batch, executor)
+    return channel
+
+
+def attachment(message):
+    [part] = [part for part in message.walk() if part.get_filename()]
+    return part.get_payload(decode=True)
+
+
+def test_email_is_sent_with_ticket_results(notifier, storage, outbox):
+    storage.put("abc123_results.json", b'{"Turdus merula": {}}')
+    storage.put("Turdus_merlula.json", b'{"another": "ticket"}')
+
+    channel = process(notifier, [feedback()])
+
+    [message] = outbox.messages
+    assert message["To"] == "user@example.com"
+    assert attachment(message) == b'{"Turdus merula": {}}'
+    assert storage.marker("notifications/abc123_done")["state"] == "sent"
+    assert channel.published == []
+    assert channel.acked == [1]
+
+
+def test_duplicates_are_sent_once(notifier, storage, outbox):
+    storage.put("abc123_results.json", b"{}")
+
+    channel = process(notifier, [feedback(), feedback()])
+    assert len(outbox.messages) == 1
+    assert sorted(channel.acked) == [1, 2]
+
+    # Delivered in an earlier batch
+    channel = process(notifier, [feedback()])
+    assert len(outbox.messages) == 1
+    assert channel.published == []
+    assert channel.acked == [1]
+
+
+def test_failure_email_needs_no_results(notifier, storage, outbox):
+    body = json.dumps(
+        {"email": "user@example.com", "ticket_number": "abc123", "status": "failed"}
+    ).encode()
+    channel = process(notifier, [body])
+
+    [message] = outbox.messages
+    assert "abc123" in message["Subject"]
+    assert storage.marker("notifications/abc123_failed")["state"] == "sent"
+    assert channel.acked == [1]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"not json",
+        b"[1, 2]",
+        json.dumps({"ticket_number": "abc123"}).encode(),
+        feedback(results_minio_path=None),
+    ],
+)
+def test_malformed_message_is_dead_lettered(notifier, storage, outbox, body):
+    channel = process(notifier, [body])
+
+    [(queue, published, headers)] = channel.published
+    assert (queue, published) == (DEAD_LETTER_QUEUE, body)
+    assert headers[RETRY_HEADER] == 1
+    assert outbox.messages == []
+    assert channel.acked == [1]
+
+
+def test_missing_results_are_retried_and_claim_released(notifier, storage, outbox):
+    channel = process(notifier, [feedback()], headers={RETRY_HEADER: 1})
+
+    [(queue, _, headers)] = channel.published
+    assert queue == FEEDBACK_QUEUE
+    assert headers[RETRY_HEADER] == 2
+    assert "notifications/abc123_done" not in storage.objects
+    assert outbox.messages == []
+    assert channel.acked == [1]
+
+    channel = process(notifier, [feedback()], headers={RETRY_HEADER: 2})
+    assert [queue for queue, _, _ in channel.published] == [DEAD_LETTER_QUEUE]
+
+
+def test_unexpected_error_is_retried(notifier, storage, outbox, monkeypatch):
+    storage.put("abc123_results.json", b"{}")
+
+    def build_results_email(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(notifier, "build_results_email", build_results_email)
+    channel = process(notifier, [feedback()])
+
+    assert [queue for queue, _, _ in channel.published] == [FEEDBACK_QUEUE]
+    assert "notifications/abc123_done" not in storage.objects
+    assert channel.acked == [1]
+
+
+def test_unreadable_marker_is_retried(notifier, storage, outbox, monkeypatch):
+    def get_object(bucket_name, name):
+        raise S3Error("AccessDenied", "denied", name, "request", "host", None)
+
+    monkeypatch.setattr(storage, "get_object", get_object)
+    channel = process(notifier, [feedback()])
+
+    assert [queue for queue, _, _ in channel.published] == [FEEDBACK_QUEUE]
+    assert outbox.messages == []
+    assert channel.acked == [1]
+
+
+def test_unsent_email_is_retried_and_claim_released(notifier, storage, outbox):
+    storage.put("abc123_results.json", b"{}")
+    outbox.fail = True
+
+    channel = process(notifier, [feedback()])
+
+    [(queue, _, headers)] = channel.published
+    assert queue == FEEDBACK_QUEUE
+    assert headers["x-last-error"] == "email not sent"
+    assert "notifications/abc123_done" not in storage.objects
+    assert channel.acked == [1]
+
+
+def claim_by_other(notifier, storage, claimed_at):
+    storage.put(
+        "notifications/abc123_done",
+        json.dumps(
+            {"state": "sending", "owner": "other:1", "claimed_at": claimed_at}
+        ).encode(),
+    )
+
+
+def test_fresh_claim_of_another_replica_is_skipped(notifier, storage, outbox):
+    storage.put("abc123_results.json", b"{}")
+    claim_by_other(notifier, storage, time.time())
+
+    channel = process(notifier, [feedback()])
+
+    assert outbox.messages == []
+    assert channel.published == []
+    assert channel.acked == [1]
+    assert storage.marker("notifications/abc123_done")["owner"] == "other:1"
+
+
+@pytest.mark.parametrize(
+    "claimed_at, redelivered", [(time.time() - 3600, False), (time.time(), True)]
+)
+def test_stale_or_redelivered_claim_is_taken_over(
+    notifier, storage, outbox, claimed_at, redelivered
+):
+    storage.put("abc123_results.json", b"{}")
+    claim_by_other(notifier, storage, claimed_at)
+
+    process(notifier, [feedback()], redelivered=redelivered)
+
+    assert len(outbox.messages) == 1
+    marker = storage.marker("notifications/abc123_done")
+    assert (marker["state"], marker["owner"]) == ("sent", notifier.OWNER)
+
+
+def test_concurrent_claim_is_skipped(notifier, storage, outbox, monkeypatch):
+    storage.put("abc123_results.json", b"{}")
+    read_marker = notifier.read_marker
+
+    def racing_read_marker(notification):
+        # Another replica claims the notification right after it was read
+        marker = read_marker(notification)
+        claim_by_other(notifier, storage, time.time())
+        return marker
+
+    monkeypatch.setattr(notifier, "read_marker", racing_read_marker)
+    channel = process(notifier, [feedback()])
+
+    assert outbox.messages == []
+    assert channel.published == []
+    assert channel.acked == [1]
+
+
+class FakeHTTP:
+    def __init__(self, status, etag='"1"') -> None:
+        self.status = status
+        self.etag = etag
+        self.requests = []
+
+    def request(self, method, url, body, headers):
+        self.requests.append((method, url, body, headers))
+        return SimpleNamespace(status=self.status, headers={"ETag": self.etag}, data=b"")
+
+
+class FakePresigner:
+    def presigned_put_object(self, bucket_name, name, expires):
+        return f"http://minio/{bucket_name}/{name}?signature"
+
+
+@pytest.mark.parametrize(
+    "etag, header", [(None, {"If-None-Match": "*"}), ('"0"', {"If-Match": '"0"'})]
+)
+def test_conditional_write(monkeypatch, etag, header):
+    http = FakeHTTP(200)
+    monkeypatch.setattr(minio_utils, "http_client", http)
+
+    written = minio_utils.write_file_to_minio_if(
+        FakePresigner(), BUCKET, "marker", b"data", etag=etag
+    )
+    assert written == '"1"'
+    assert http.requests == [
+        ("PUT", "http://minio/bucket/marker?signature", b"data", header)
+    ]
+
+
+@pytest.mark.parametrize("status", [409, 412])
+def test_conditional_write_conflict(monkeypatch, status):
+    monkeypatch.setattr(minio_utils, "http_client", FakeHTTP(status))
+    assert minio_utils.write_file_to_minio_if(FakePresigner(), BUCKET, "m", b"") is None
+
+
+def test_conditional_write_error(monkeypatch):
+    monkeypatch.setattr(minio_utils, "http_client", FakeHTTP(503))
+    with pytest.raises(OSError):
+        minio_utils.write_file_to_minio_if(FakePresigner(), BUCKET, "m", b"")
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sf = pytest.importorskip("soundfile")
+
+from model_serve.prefilter import ActivityPrefilter  # noqa: E402
+
+SAMPLE_WAV = os.path.join(
+    os.path.dirname(__file__), "..", "app", "api", "Turdus_merlula.wav"
+)
+SAMPLE_RATE = 44100
+
+
+def noise(kind, seconds=60, seed=0):
+    rng = np.random.default_rng(seed)
+    n_samples = seconds * SAMPLE_RATE
+    white = rng.standard_normal(n_samples)
+    if kind == "white":
+        samples = white
+    else:
+        # Pink (1/f) or brown (1/f^2, close to wind) noise
+        exponent = {"pink": 0.5, "brown": 1.0}[kind]
+        frequencies = np.fft.rfftfreq(n_samples, 1 / SAMPLE_RATE)
+        frequencies[0] = frequencies[1]
+        samples = np.fft.irfft(np.fft.rfft(white) / frequencies**exponent, n_samples)
+    return (0.3 * samples / np.abs(samples).max()).astype(np.float32)
+
+
+def test_sample_recording_is_active():
+    samples, sample_rate = sf.read(SAMPLE_WAV, dtype="float32")
+    assert ActivityPrefilter().window_activity(samples, sample_rate).any()
+
+
+@pytest.mark.parametrize("kind", ["white", "pink", "brown"])
+def test_broadband_noise_is_inactive(kind):
+    assert not ActivityPrefilter().window_activity(noise(kind), SAMPLE_RATE).any()
+
+
+def test_silence_is_inactive():
+    samples = np.zeros(3 * SAMPLE_RATE, dtype=np.float32)
+    assert not ActivityPrefilter().window_activity(samples, SAMPLE_RATE).any()
+
+
+def test_activity_does_not_depend_on_blocks():
+    samples = noise("pink", seconds=10)
+    samples[SAMPLE_RATE : 2 * SAMPLE_RATE] += 0.3 * np.sin(
+        2 * np.pi * 3000 * np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    ).astype(np.float32)
+    blocked = ActivityPrefilter(frames_per_block=7).frame_activity(samples, SAMPLE_RATE)
+    whole = ActivityPrefilter().frame_activity(samples, SAMPLE_RATE)
+    assert (blocked == whole).all() and whole.any()
+
+
+def test_scan_finds_active_segments(tmp_path):
+    samples, sample_rate = sf.read(SAMPLE_WAV, dtype="float32")
+    silence = np.zeros(30 * sample_rate, dtype=np.float32)
+    padded = np.concatenate([silence, samples, silence])
+    sf.write(tmp_path / "padded.wav", padded, sample_rate)
+
+    report = ActivityPrefilter(chunk_seconds=10).scan(str(tmp_path / "padded.wav"))
+    assert report["windows"] == pytest.approx(report["duration_seconds"], abs=1)
+    assert 0 < report["active_windows"] <= 4
+    assert report["duration_seconds"] == pytest.approx(63, abs=0.1)
+    [(start, end)] = report["segments"]
+    assert 29 <= start and end <= 36 and end - start >= 3
+
+
+def test_active_segments_are_padded_and_merged():
+    prefilter = ActivityPrefilter(window_seconds=1.0, padding_seconds=1.0)
+    active = np.zeros(20, dtype=bool)
+    active[[0, 3, 4, 10, 19]] = True
+    assert prefilter.active_segments(active, 19.5) == [
+        (0.0, 6.0),
+        (9.0, 12.0),
+        (18.0, 19.5),
+    ]
+    assert prefilter.active_segments(np.zeros(5, dtype=bool), 5.0) == []
+
+
+def test_write_segment(tmp_path):
+    samples = np.linspace(-0.5, 0.5, 4 * SAMPLE_RATE).astype(np.float32)
+    sf.write(tmp_path / "clip.wav", samples, SAMPLE_RATE, subtype="FLOAT")
+
+    ActivityPrefilter().write_segment(
+        str(tmp_path / "clip.wav"), 1.0, 2.5, str(tmp_path / "segment.wav")
+    )
+    segment, sample_rate = sf.read(tmp_path / "segment.wav", dtype="float32")
+    assert sample_rate == SAMPLE_RATE
+    assert np.array_equal(segment, samples[SAMPLE_RATE : int(2.5 * SAMPLE_RATE)])
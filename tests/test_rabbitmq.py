@@ -0,0 +1,191 @@
+import json
+import signal
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pika")
+
+from app_utils.rabbitmq import (  # noqa: E402
+    RETRY_HEADER,
+    MessageTimeoutError,
+    NonRetryableMessageError,
+    consume_messages_safely,
+    time_limit,
+)
+
+QUEUE = "work"
+DEAD_LETTER_QUEUE = "work_dead_letter"
+
+
+class FakeChannel:
+    """Records what the consumer publishes and acknowledges."""
+
+    def __init__(self) -> None:
+        self.declared = []
+        self.published = []
+        self.acked = []
+        self.on_message = None
+
+    def queue_declare(self, queue):
+        self.declared.append(queue)
+
+    def basic_consume(self, queue, on_message_callback):
+        self.on_message = on_message_callback
+
+    def start_consuming(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((routing_key, body, dict(properties.headers or {})))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+    def deliver(self, body, headers=None, redelivered=False, delivery_tag=1):
+        method = SimpleNamespace(delivery_tag=delivery_tag, redelivered=redelivered)
+        self.on_message(self, method, SimpleNamespace(headers=headers), body)
+
+
+def consume(callback, max_retries=2, on_failure=None, timeout=None):
+    channel = FakeChannel()
+    consume_messages_safely(
+        channel,
+        QUEUE,
+        callback,
+        DEAD_LETTER_QUEUE,
+        max_retries=max_retries,
+        timeout=timeout,
+        on_failure=on_failure,
+    )
+    return channel
+
+
+def failing(error):
+    def callback(body):
+        raise error
+
+    return callback
+
+
+BODY = json.dumps({"ticket_number": "abc123"}).encode()
+
+
+def test_success_is_acknowledged_without_republishing():
+    received = []
+    channel = consume(received.append)
+    channel.deliver(BODY)
+    assert received == [BODY]
+    assert channel.published == []
+    assert channel.acked == [1]
+    assert channel.declared == [DEAD_LETTER_QUEUE]
+
+
+def test_failure_is_republished_with_retry_count_incremented():
+    channel = consume(failing(RuntimeError("boom")))
+    channel.deliver(BODY, headers={RETRY_HEADER: 1, "x-other": "kept"})
+
+    [(queue, body, headers)] = channel.published
+    assert (queue, body) == (QUEUE, BODY)
+    assert headers[RETRY_HEADER] == 2
+    assert headers["x-last-error"] == "boom"
+    assert headers["x-other"] == "kept"
+    assert channel.acked == [1]
+
+
+def test_failure_is_dead_lettered_after_max_retries():
+    failures = []
+    channel = consume(
+        failing(RuntimeError("boom")),
+        max_retries=2,
+        on_failure=lambda body, error: failures.append((body, str(error))),
+    )
+    channel.deliver(BODY)
+    channel.deliver(BODY, headers={RETRY_HEADER: 1})
+    channel.deliver(BODY, headers={RETRY_HEADER: 2})
+
+    assert [queue for queue, _, _ in channel.published] == [
+        QUEUE,
+        QUEUE,
+        DEAD_LETTER_QUEUE,
+    ]
+    assert channel.published[-1][2][RETRY_HEADER] == 3
+    assert failures == [(BODY, "boom")]
+    assert len(channel.acked) == 3
+
+
+def test_non_retryable_error_is_dead_lettered_right_away():
+    failures = []
+    channel = consume(
+        failing(NonRetryableMessageError("unknown model")),
+        max_retries=5,
+        on_failure=lambda body, error: failures.append(body),
+    )
+    channel.deliver(BODY)
+
+    [(queue, _, headers)] = channel.published
+    assert queue == DEAD_LETTER_QUEUE
+    assert headers[RETRY_HEADER] == 1
+    assert failures == [BODY]
+    assert channel.acked == [1]
+
+
+def test_redelivered_message_counts_as_failed_attempt():
+    received = []
+    channel = consume(received.append)
+    channel.deliver(BODY, redelivered=True)
+
+    assert received == []
+    [(queue, _, headers)] = channel.published
+    assert queue == QUEUE
+    assert headers[RETRY_HEADER] == 1
+    assert "Worker stopped" in headers["x-last-error"]
+    assert channel.acked == [1]
+
+
+def test_on_failure_errors_are_swallowed():
+    def on_failure(body, error):
+        raise RuntimeError("feedback queue down")
+
+    channel = consume(failing(RuntimeError("boom")), max_retries=0, on_failure=on_failure)
+    channel.deliver(BODY)
+
+    assert [queue for queue, _, _ in channel.published] == [DEAD_LETTER_QUEUE]
+    assert channel.acked == [1]
+
+
+def test_timeout_counts_as_failed_attempt():
+    channel = consume(lambda body: time.sleep(2), timeout=0.05)
+    channel.deliver(BODY)
+
+    [(queue, _, headers)] = channel.published
+    assert queue == QUEUE
+    assert "exceeded" in headers["x-last-error"]
+
+
+def test_time_limit_raises_and_restores_previous_handler():
+    def previous_handler(signum, frame):
+        pass
+
+    original = signal.signal(signal.SIGALRM, previous_handler)
+    try:
+        with pytest.raises(MessageTimeoutError):
+            with time_limit(0.05):
+                time.sleep(2)
+        assert signal.getsignal(signal.SIGALRM) is previous_handler
+        assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+
+        # The timer is cancelled when the block finishes in time
+        with time_limit(0.05):
+            pass
+        time.sleep(0.1)
+        assert signal.getsignal(signal.SIGALRM) is previous_handler
+    finally:
+        signal.signal(signal.SIGALRM, original)
+
+
+def test_time_limit_disabled():
+    with time_limit(None):
+        pass
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
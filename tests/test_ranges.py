@@ -0,0 +1,45 @@
+import pytest
+
+from app_utils.ranges import parse_range_header
+
+
+@pytest.mark.parametrize(
+    "range_header, expected",
+    [
+        ("bytes=0-0", (0, 0)),
+        ("bytes=0-99", (0, 99)),
+        ("bytes=10-", (10, 99)),
+        ("bytes=90-200", (90, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=-500", (0, 99)),
+        (" bytes = 5-9", (5, 9)),
+    ],
+)
+def test_satisfiable_ranges(range_header, expected):
+    assert parse_range_header(range_header, 100) == expected
+
+
+@pytest.mark.parametrize(
+    "range_header",
+    [
+        "bytes=-0",
+        "bytes=100-",
+        "bytes=100-200",
+        "bytes=50-10",
+        "bytes=-",
+        "bytes=a-b",
+        "bytes=0-1,5-9",
+        "items=0-10",
+        "",
+    ],
+)
+def test_unsatisfiable_ranges(range_header):
+    with pytest.raises(ValueError):
+        parse_range_header(range_header, 100)
+
+
+def test_empty_object_has_no_satisfiable_range():
+    with pytest.raises(ValueError):
+        parse_range_header("bytes=0-", 0)
+    with pytest.raises(ValueError):
+        parse_range_header("bytes=-10", 0)
@@ -0,0 +1,46 @@
+import struct
+
+import pytest
+
+from app_utils.results import HEADER, decode_results, encode_results
+
+
+def test_round_trip():
+    output = {
+        "Turdus merula": {
+            "bbox_coord": [[0.0, 10.5, 42.25, 80.0], [100.0, 12.0, 130.5, 60.0]],
+            "scores": [0.875, 0.5],
+        },
+        "Érithacus rubecula": {
+            "bbox_coord": [[3.0, 4.0, 5.0, 6.0]],
+            "scores": [0.25],
+        },
+    }
+    assert decode_results(encode_results(output)) == output
+
+
+def test_float32_precision():
+    output = {"Parus major": {"bbox_coord": [[0.1, 0.2, 0.3, 0.4]], "scores": [0.9]}}
+    decoded = decode_results(encode_results(output))["Parus major"]
+    assert decoded["bbox_coord"][0] == pytest.approx([0.1, 0.2, 0.3, 0.4], rel=1e-6)
+    assert decoded["scores"] == pytest.approx([0.9], rel=1e-6)
+
+
+def test_empty_output():
+    data = encode_results({})
+    assert len(data) == HEADER.size
+    assert decode_results(data) == {}
+
+
+def test_species_without_detections():
+    output = {"Turdus merula": {"bbox_coord": [], "scores": []}}
+    assert decode_results(encode_results(output)) == output
+
+
+def test_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        decode_results(HEADER.pack(b"JSON", 1, 0))
+    with pytest.raises(ValueError):
+        decode_results(HEADER.pack(b"BSCR", 2, 0))
+    with pytest.raises(struct.error):
+        decode_results(b"BSC")